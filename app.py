@@ -7,7 +7,7 @@ import json
 # --- Login Route -5
 import pandas as pd
 import numpy as np
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response
 from sklearn.linear_model import LinearRegression
 from sklearn.tree import DecisionTreeRegressor
 import os
@@ -16,6 +16,7 @@ import datetime
 import cv2
 import logging
 import base64
+import csv
 import json
 from werkzeug.utils import secure_filename
 import serial
@@ -23,8 +24,24 @@ import serial.tools.list_ports
 import threading
 import queue
 import time
+import uuid
+import heapq
+import hashlib
+import sqlite3
+import contextlib
+import click
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+try:
+    import fcntl  # POSIX only; on Windows the file locks below only cover this process
+except ImportError:
+    fcntl = None
+try:
+    import pyarrow  # Optional; needed for the Parquet archive of closed attendance days
+except ImportError:
+    pyarrow = None
 
 app = Flask(__name__)
 app.secret_key = 'your_super_secret_key_here'
@@ -38,18 +55,832 @@ MODELS_FOLDER = 'models'
 ID_MAP_FILE = os.path.join(MODELS_FOLDER, 'id_map.json')
 MODEL_FILE = os.path.join(MODELS_FOLDER, "trainer.yml")
 FINGERPRINT_MAP_FILE = os.path.join(MODELS_FOLDER, 'fingerprint_map.json')
+TRAIN_STATE_FILE = os.path.join(MODELS_FOLDER, 'train_state.json')
+FACE_DECODE_WORKERS = os.cpu_count() or 4
+FACE_SAMPLES_FILE = os.path.join(MODELS_FOLDER, 'face_samples.u8')
+FACE_LABELS_FILE = os.path.join(MODELS_FOLDER, 'face_labels.i32')
+FACE_SAMPLES_INDEX_FILE = os.path.join(MODELS_FOLDER, 'face_samples.json')
+FACE_SIZE = (200, 200)
+ATTENDANCE_LEDGER_FILE = os.path.join(ATTENDANCE_FOLDER, 'ledger.csv')
+ATTENDANCE_ARCHIVE_FOLDER = os.path.join(ATTENDANCE_FOLDER, 'archive')
+USERS_FILE = 'users.json'
+STORAGE_BACKEND = os.environ.get('TRACQUE_STORAGE', 'csv').strip().lower()  # 'csv' (the files above) or 'sqlite'
+SQLITE_DB_FILE = os.environ.get('TRACQUE_DB', 'tracque.db')
+
+# --- File Locking & Atomic Writes ---
+class FileLock:
+    """Reentrant lock for one data file.
+
+    Threads of this process serialize on an RLock; where fcntl is available,
+    an exclusive flock on '<path>.lock' also keeps other worker processes out.
+    """
+
+    def __init__(self, path):
+        self.lock_path = path + '.lock'
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._handle = open(self.lock_path, 'a+')
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX)
+            except Exception:
+                if self._handle is not None:
+                    self._handle.close()
+                    self._handle = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0 and self._handle is not None:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            self._handle.close()
+            self._handle = None
+        self._lock.release()
+        return False
+
+_file_locks = {}
+_file_locks_guard = threading.Lock()
+
+def file_lock(path):
+    """Returns the shared FileLock for path (one per file, per process)."""
+    key = os.path.abspath(path)
+    with _file_locks_guard:
+        lock = _file_locks.get(key)
+        if lock is None:
+            lock = _file_locks[key] = FileLock(key)
+        return lock
+
+def atomic_write(path, write, mode='w', **open_kwargs):
+    """Calls write(f) on a temp file next to path, fsyncs it and renames it over path.
+
+    Readers see either the old file or the new one, never a half-written one.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, **open_kwargs) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def file_stamp(path):
+    """(mtime_ns, size) of path, or None if it does not exist; changes whenever any process rewrites it."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# --- Storage Backends ---
+class CsvStorage:
+    """Keeps state in the original files: students_data.csv, the attendance
+    ledger plus one CSV per day, users.json and the JSON maps under models/.
+
+    Closed days can be compacted into one Parquet file per month under
+    attendance/archive/ (needs pyarrow). The ledger and daily CSVs then only
+    hold the open days, and archived marks are read column- and month-wise.
+
+    Every backend offers the same methods. RosterStore, AttendanceLedger and
+    FingerprintSlotRegistry keep their in-memory indexes on top of it, use the
+    *_stamp() values to notice writes made by another worker process and hold
+    lock(area) across each read-modify-write.
+
+    A read_only instance (the import-storage source) never writes: a missing
+    ledger is built from the daily files in memory instead of being saved.
+    """
+
+    name = 'csv'
+    DAILY_COLUMNS = ['Student ID', 'Name', 'Time']
+    LEDGER_COLUMNS = ['Date', 'Student ID', 'Name', 'Time']
+
+    def __init__(self, data_file, ledger_file, attendance_folder, archive_folder, fingerprint_map_file, documents, read_only=False):
+        self.data_file = data_file
+        self.ledger_file = ledger_file
+        self.attendance_folder = attendance_folder
+        self.archive_folder = archive_folder
+        self.archive_days_file = os.path.join(archive_folder, 'days.json')
+        self.fingerprint_map_file = fingerprint_map_file
+        self.documents = dict(documents)  # document name -> JSON file
+        self.read_only = read_only
+        self._lock_paths = {
+            'roster': data_file,
+            'attendance': ledger_file,
+            'fingerprints': fingerprint_map_file,
+        }
+        self._lock_paths.update(self.documents)
+
+    def lock(self, area):
+        """Cross-process lock for a read-modify-write of 'roster', 'attendance', 'fingerprints' or a document."""
+        return file_lock(self._lock_paths[area])
+
+    # Roster
+    def roster_stamp(self):
+        return file_stamp(self.data_file)
+
+    def load_roster(self):
+        """Returns the roster DataFrame, or None if there is none yet."""
+        try:
+            if os.path.exists(self.data_file) and os.path.getsize(self.data_file) > 0:
+                # This dtype={'student_id': str} is essential for alphanumeric IDs.
+                return pd.read_csv(self.data_file, dtype={'student_id': str})
+        except Exception as e:
+            app.logger.error(f"Error loading CSV: {e}")
+        return None
+
+    def save_roster(self, df):
+        atomic_write(self.data_file, lambda f: df.to_csv(f, index=False), newline='', encoding='utf-8')
+
+    # Attendance
+    def _daily_file(self, day):
+        return os.path.join(self.attendance_folder, f"attendance_{day}.csv")
+
+    def _daily_files(self):
+        return glob.glob(os.path.join(self.attendance_folder, 'attendance_*.csv'))
+
+    @staticmethod
+    def _day_from_path(file_path):
+        return os.path.basename(file_path).replace('attendance_', '').replace('.csv', '')
+
+    def _read_ledger(self):
+        try:
+            return pd.read_csv(self.ledger_file, dtype=str, keep_default_na=False)
+        except (pd.errors.EmptyDataError, FileNotFoundError):
+            return pd.DataFrame(columns=self.LEDGER_COLUMNS)
+
+    def _write_ledger(self, rows):
+        def write(f):
+            writer = csv.writer(f)
+            writer.writerow(self.LEDGER_COLUMNS)
+            writer.writerows(rows)
+        atomic_write(self.ledger_file, write, newline='', encoding='utf-8')
+
+    def _rows_from_daily_files(self):
+        """Collects all rows from the per-day CSVs (used to seed a missing ledger)."""
+        rows = []
+        for file_path in sorted(self._daily_files()):
+            day = self._day_from_path(file_path)
+            try:
+                daily_df = pd.read_csv(file_path, dtype=str, keep_default_na=False)
+            except Exception:
+                continue
+            for record in daily_df.to_dict(orient='records'):
+                rows.append([day, str(record.get('Student ID', '')).strip(), record.get('Name', ''), record.get('Time', '')])
+        return rows
+
+    def attendance_stamp(self):
+        # A folder's mtime moves when a daily file or archive partition is created or replaced
+        return (file_stamp(self.ledger_file), file_stamp(self.attendance_folder), file_stamp(self.archive_folder))
+
+    def _hot_marks(self):
+        """The ledger (marks of days not archived yet) as a DataFrame of strings."""
+        if not os.path.exists(self.ledger_file):
+            rows = self._rows_from_daily_files()
+            if not self.read_only:
+                os.makedirs(self.attendance_folder, exist_ok=True)
+                self._write_ledger(rows)
+                app.logger.info(f"Attendance ledger created from {len(self._daily_files())} daily files")
+            return pd.DataFrame(rows, columns=self.LEDGER_COLUMNS)
+        return self._read_ledger()[self.LEDGER_COLUMNS]
+
+    # Columnar archive of closed days
+    def _partition_file(self, month):
+        return os.path.join(self.archive_folder, f"attendance_{month}.parquet")
+
+    def _partitions(self, start=None, end=None):
+        """Archive files whose month overlaps start..end (inclusive YYYY-MM-DD bounds; None is open)."""
+        files = []
+        for path in sorted(glob.glob(os.path.join(self.archive_folder, 'attendance_*.parquet'))):
+            month = os.path.basename(path)[len('attendance_'):-len('.parquet')]
+            if (start is None or month >= start[:7]) and (end is None or month <= end[:7]):
+                files.append(path)
+        return files
+
+    def archived_days(self):
+        if not os.path.exists(self.archive_days_file):
+            return set()
+        with open(self.archive_days_file, 'r') as f:
+            return set(json.load(f))
+
+    def _read_archive(self, columns, start=None, end=None):
+        filters = []
+        if start is not None:
+            filters.append(('Date', '>=', start))
+        if end is not None:
+            filters.append(('Date', '<=', end))
+        frames = [pd.read_parquet(path, columns=columns, filters=filters or None)
+                  for path in self._partitions(start, end)]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    def scan_marks(self, columns=None, start=None, end=None):
+        """Marks dated start..end (inclusive YYYY-MM-DD; None is open) as a DataFrame, oldest first.
+
+        Only the archive months in range are opened, and only the requested
+        columns are read from them.
+        """
+        columns = list(columns or self.LEDGER_COLUMNS)
+        read_columns = columns if 'Date' in columns else ['Date'] + columns
+        hot = self._hot_marks()
+        if start is not None:
+            hot = hot[hot['Date'] >= start]
+        if end is not None:
+            hot = hot[hot['Date'] <= end]
+        marks = pd.concat([self._read_archive(read_columns, start, end), hot[read_columns]], ignore_index=True)
+        return marks[columns]
+
+    def mark_rows(self):
+        """Every mark as [date, student_id, name, time], oldest first."""
+        return self.scan_marks().values.tolist()
+
+    def load_marks(self):
+        """Every mark as (date, student_id); all the presence index needs."""
+        return list(self.scan_marks(['Date', 'Student ID']).itertuples(index=False, name=None))
+
+    def load_days(self):
+        """Days that were opened, including those with no marks yet."""
+        return {self._day_from_path(file_path) for file_path in self._daily_files()} | self.archived_days()
+
+    def compact_attendance(self, before_day):
+        """Moves the days before before_day out of the ledger and daily CSVs into the monthly archive.
+
+        Returns the archived days. Caller holds the attendance lock.
+        """
+        if pyarrow is None:
+            app.logger.warning("pyarrow is not installed; attendance archive compaction skipped")
+            return []
+        hot = self._hot_marks()
+        daily_days = {self._day_from_path(file_path) for file_path in self._daily_files()}
+        closed_days = sorted(day for day in set(hot['Date']) | daily_days if day < before_day)
+        if not closed_days:
+            return []
+        os.makedirs(self.archive_folder, exist_ok=True)
+        closed = hot[hot['Date'] < before_day]
+        for month, rows in closed.groupby(closed['Date'].str[:7]):
+            path = self._partition_file(month)
+            if os.path.exists(path):
+                rows = pd.concat([pd.read_parquet(path), rows], ignore_index=True)
+            # An interrupted earlier run may have archived some of these rows already
+            rows = rows.drop_duplicates(['Date', 'Student ID']).sort_values('Date', kind='stable')
+            atomic_write(path, lambda f: rows.to_parquet(f, index=False), mode='wb')
+        archived_days = sorted(self.archived_days() | set(closed_days))
+        atomic_write(self.archive_days_file, lambda f: json.dump(archived_days, f))
+        self._write_ledger(hot[hot['Date'] >= before_day].values.tolist())
+        for day in closed_days:
+            if os.path.exists(self._daily_file(day)):
+                os.remove(self._daily_file(day))
+        app.logger.info(f"Archived {len(closed)} attendance marks from {len(closed_days)} days")
+        return closed_days
+
+    def add_day(self, day):
+        daily_file = self._daily_file(day)
+        if not os.path.exists(daily_file):
+            os.makedirs(self.attendance_folder, exist_ok=True)
+            atomic_write(daily_file, lambda f: csv.writer(f).writerow(self.DAILY_COLUMNS),
+                         newline='', encoding='utf-8')
+
+    def append_marks(self, rows_by_day):
+        """Appends {day: [[student_id, name, time], ...]} with one fsync per file."""
+        with open(self.ledger_file, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([day] + row for day, rows in rows_by_day.items() for row in rows)
+            f.flush()
+            os.fsync(f.fileno())
+        for day, rows in rows_by_day.items():
+            with open(self._daily_file(day), 'a', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerows(rows)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def day_events(self, day):
+        """The day's rows ('Student ID', 'Name', 'Time') in the order they were marked."""
+        daily_file = self._daily_file(day)
+        if not os.path.exists(daily_file):
+            if day in self.archived_days():
+                return self.scan_marks(self.DAILY_COLUMNS, start=day, end=day).to_dict(orient='records')
+            return []
+        try:
+            daily_df = pd.read_csv(daily_file, dtype={'Student ID': str})
+        except (pd.errors.EmptyDataError, KeyError):
+            return []
+        return daily_df.to_dict(orient='records')
+
+    def remove_student_marks(self, student_id):
+        ledger_df = self._read_ledger()
+        if not ledger_df.empty:
+            self._write_ledger(ledger_df[ledger_df['Student ID'].str.strip() != student_id][self.LEDGER_COLUMNS].values.tolist())
+        for file_path in self._daily_files():
+            try:
+                att_df = pd.read_csv(file_path, dtype={'Student ID': str})
+                if not att_df.empty and student_id in att_df['Student ID'].values:
+                    kept_df = att_df[att_df['Student ID'] != student_id]
+                    atomic_write(file_path, lambda f: kept_df.to_csv(f, index=False), newline='')
+                    app.logger.info(f"Removed student {student_id} from attendance log: {os.path.basename(file_path)}")
+            except (pd.errors.EmptyDataError, FileNotFoundError) as e:
+                app.logger.warning(f"Could not modify attendance file {file_path} during deletion: {e}")
+        for file_path in self._partitions():
+            archived = pd.read_parquet(file_path)
+            if student_id in archived['Student ID'].values:
+                kept_df = archived[archived['Student ID'] != student_id]
+                atomic_write(file_path, lambda f: kept_df.to_parquet(f, index=False), mode='wb')
+                app.logger.info(f"Removed student {student_id} from attendance archive: {os.path.basename(file_path)}")
+
+    # JSON documents (users, id_map)
+    def document_stamp(self, name):
+        return file_stamp(self.documents[name])
+
+    def load_document(self, name, default=None):
+        path = self.documents[name]
+        if not os.path.exists(path):
+            return default
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def save_document(self, name, value):
+        atomic_write(self.documents[name], lambda f: json.dump(value, f, indent=2))
+
+    # Fingerprint slots
+    def fingerprint_stamp(self):
+        return file_stamp(self.fingerprint_map_file)
+
+    def load_fingerprint_map(self):
+        """student_id -> (sensor_id, slot); sensor_id is None for entries from before several readers."""
+        fp_map = {}
+        if os.path.exists(self.fingerprint_map_file):
+            try:
+                with open(self.fingerprint_map_file, 'r') as f:
+                    fp_map = json.load(f)
+            except Exception as e:
+                app.logger.error(f"Error reading {self.fingerprint_map_file}: {e}")
+        slots = {}
+        for sid, entry in fp_map.items():
+            if isinstance(entry, dict):
+                slots[str(sid)] = (entry.get('sensor'), entry.get('slot'))
+            else:
+                slots[str(sid)] = (None, entry)
+        return slots
+
+    def save_fingerprint_map(self, slots):
+        fp_map = {}
+        for sid, (sensor_id, slot) in slots.items():
+            fp_map[sid] = slot if sensor_id is None else {'sensor': sensor_id, 'slot': slot}
+        atomic_write(self.fingerprint_map_file, lambda f: json.dump(fp_map, f, indent=2))
+
+
+class SqliteStorage:
+    """Keeps the same state in one SQLite database.
+
+    The database runs in WAL mode, so readers never wait for the writer.
+    Marks are indexed by (date, student_id) and by student_id, so per-day
+    lists, presence checks and per-student deletes don't scan the whole
+    history. The roster table is rewritten in one transaction and keeps the
+    roster's own column layout. Each area has a version row in meta; it is
+    bumped by every write and serves as that area's stamp.
+    """
+
+    name = 'sqlite'
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS attendance (id INTEGER PRIMARY KEY, date TEXT NOT NULL, student_id TEXT NOT NULL, name TEXT, time TEXT)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_date_student ON attendance (date, student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance (student_id)",
+        "CREATE TABLE IF NOT EXISTS attendance_days (date TEXT PRIMARY KEY)",
+        "CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, body TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS fingerprint_slots (student_id TEXT PRIMARY KEY, sensor TEXT, slot INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprint_slots_sensor ON fingerprint_slots (sensor, slot)",
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()  # One connection per thread
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            # isolation_level=None: transactions are opened explicitly by _write()
+            con = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=FULL")
+            with self._schema_lock:
+                if not self._schema_ready:
+                    for statement in self.SCHEMA:
+                        con.execute(statement)
+                    self._schema_ready = True
+            self._local.con = con
+        return con
+
+    @contextlib.contextmanager
+    def _write(self):
+        con = self._connect()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+
+    @staticmethod
+    def _bump(con, area):
+        con.execute("INSERT INTO meta (key, version) VALUES (?, 1) "
+                    "ON CONFLICT(key) DO UPDATE SET version = version + 1", (area,))
+
+    def _version(self, area):
+        row = self._connect().execute("SELECT version FROM meta WHERE key = ?", (area,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _quote(column):
+        return '"' + str(column).replace('"', '""') + '"'
+
+    def lock(self, area):
+        return file_lock(f"{self.path}.{area}")
+
+    # Roster
+    def roster_stamp(self):
+        return self._version('roster')
+
+    def load_roster(self):
+        con = self._connect()
+        if con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students'").fetchone() is None:
+            return None
+        df = pd.read_sql_query("SELECT * FROM students ORDER BY rowid", con)
+        # NULLs come back as None in text columns; the rest of the app expects NaN as from read_csv
+        return df.where(df.notna(), np.nan)
+
+    def save_roster(self, df):
+        columns = [column for column in df.columns if column != 'student_id']
+        column_defs = ', '.join(['student_id TEXT PRIMARY KEY'] + [self._quote(c) for c in columns])
+        placeholders = ', '.join('?' * (len(columns) + 1))
+        values = df[['student_id'] + columns].astype(object)
+        values = values.where(values.notna(), None)
+        with self._write() as con:
+            con.execute("DROP TABLE IF EXISTS students")
+            con.execute(f"CREATE TABLE students ({column_defs})")
+            con.executemany(f"INSERT OR REPLACE INTO students VALUES ({placeholders})",
+                            values.itertuples(index=False, name=None))
+            self._bump(con, 'roster')
+
+    # Attendance
+    def attendance_stamp(self):
+        return self._version('attendance')
+
+    COLUMN_NAMES = {'Date': 'date', 'Student ID': 'student_id', 'Name': 'name', 'Time': 'time'}
+
+    def scan_marks(self, columns=None, start=None, end=None):
+        columns = list(columns or self.COLUMN_NAMES)
+        select = ', '.join(f'{self.COLUMN_NAMES[column]} AS {self._quote(column)}' for column in columns)
+        return pd.read_sql_query(
+            f"SELECT {select} FROM attendance WHERE date >= ? AND date <= ? ORDER BY id",
+            self._connect(), params=(start or '', end or '9999-12-31'))
+
+    def mark_rows(self):
+        return [list(row) for row in self._connect().execute("SELECT date, student_id, name, time FROM attendance ORDER BY id")]
+
+    def load_marks(self):
+        return self._connect().execute("SELECT date, student_id FROM attendance").fetchall()
+
+    def load_days(self):
+        return {row[0] for row in self._connect().execute("SELECT date FROM attendance_days")}
+
+    def add_day(self, day):
+        with self._write() as con:
+            con.execute("INSERT OR IGNORE INTO attendance_days (date) VALUES (?)", (day,))
+            self._bump(con, 'attendance')
+
+    def append_marks(self, rows_by_day):
+        with self._write() as con:
+            con.executemany("INSERT OR IGNORE INTO attendance_days (date) VALUES (?)", [(day,) for day in rows_by_day])
+            con.executemany("INSERT OR IGNORE INTO attendance (date, student_id, name, time) VALUES (?, ?, ?, ?)",
+                            [(day, student_id, name, time_str) for day, rows in rows_by_day.items()
+                             for student_id, name, time_str in rows])
+            self._bump(con, 'attendance')
+
+    def compact_attendance(self, before_day):
+        """Nothing to move: marks are already indexed by date in the database."""
+        return []
+
+    def day_events(self, day):
+        rows = self._connect().execute(
+            "SELECT student_id, name, time FROM attendance WHERE date = ? ORDER BY id", (day,))
+        return [{'Student ID': student_id, 'Name': name, 'Time': time_str} for student_id, name, time_str in rows]
+
+    def remove_student_marks(self, student_id):
+        with self._write() as con:
+            deleted = con.execute("DELETE FROM attendance WHERE student_id = ?", (student_id,)).rowcount
+            self._bump(con, 'attendance')
+        app.logger.info(f"Removed {deleted} attendance marks of student {student_id}")
+
+    # JSON documents (users, id_map)
+    def document_stamp(self, name):
+        return self._version('document:' + name)
+
+    def load_document(self, name, default=None):
+        row = self._connect().execute("SELECT body FROM documents WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def save_document(self, name, value):
+        with self._write() as con:
+            con.execute("INSERT INTO documents (name, body) VALUES (?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET body = excluded.body", (name, json.dumps(value)))
+            self._bump(con, 'document:' + name)
+
+    # Fingerprint slots
+    def fingerprint_stamp(self):
+        return self._version('fingerprints')
+
+    def load_fingerprint_map(self):
+        rows = self._connect().execute("SELECT student_id, sensor, slot FROM fingerprint_slots")
+        return {student_id: (sensor_id, slot) for student_id, sensor_id, slot in rows}
+
+    def save_fingerprint_map(self, slots):
+        with self._write() as con:
+            con.execute("DELETE FROM fingerprint_slots")
+            con.executemany("INSERT INTO fingerprint_slots (student_id, sensor, slot) VALUES (?, ?, ?)",
+                            [(sid, sensor_id, slot) for sid, (sensor_id, slot) in slots.items()])
+            self._bump(con, 'fingerprints')
+
+    def import_from(self, source):
+        """Copies everything source holds into this database; returns what was copied."""
+        copied = {}
+        roster = source.load_roster()
+        if roster is not None:
+            self.save_roster(roster)
+        copied['students'] = 0 if roster is None else len(roster)
+        rows = [row for row in source.mark_rows() if str(row[1]).strip()]
+        days = source.load_days() | {row[0] for row in rows}
+        with self._write() as con:
+            con.executemany("INSERT OR IGNORE INTO attendance_days (date) VALUES (?)", [(day,) for day in days])
+            before = con.total_changes
+            con.executemany("INSERT OR IGNORE INTO attendance (date, student_id, name, time) VALUES (?, ?, ?, ?)",
+                            [(day, str(student_id).strip(), name, time_str) for day, student_id, name, time_str in rows])
+            copied['attendance_marks'] = con.total_changes - before
+            self._bump(con, 'attendance')
+        copied['attendance_days'] = len(days)
+        for name in source.documents:
+            value = source.load_document(name)
+            if value is not None:
+                self.save_document(name, value)
+                copied[name] = len(value)
+        slots = source.load_fingerprint_map()
+        self.save_fingerprint_map(slots)
+        copied['fingerprint_slots'] = len(slots)
+        return copied
+
+
+STORAGE_DOCUMENTS = {'users': USERS_FILE, 'id_map': ID_MAP_FILE}
+
+def create_storage(backend=STORAGE_BACKEND, read_only=False):
+    """read_only only applies to 'csv'; SQLite is only ever written to by import-storage."""
+    if backend == 'sqlite':
+        return SqliteStorage(SQLITE_DB_FILE)
+    if backend == 'csv':
+        return CsvStorage(DATA_FILE, ATTENDANCE_LEDGER_FILE, ATTENDANCE_FOLDER, ATTENDANCE_ARCHIVE_FOLDER,
+                          FINGERPRINT_MAP_FILE, STORAGE_DOCUMENTS, read_only=read_only)
+    raise ValueError(f"Unknown storage backend '{backend}' (expected 'csv' or 'sqlite')")
+
+storage = create_storage()
+app.logger.info(f"Using {storage.name} storage")
 
 # --- Global Models ---
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-recognizer = cv2.face.LBPHFaceRecognizer_create()
+
+class FaceModelCache:
+    """Keeps the trained LBPH recognizer and the reverse id map loaded in memory.
+
+    The model is only deserialized again when trainer.yml (checked by mtime)
+    or the stored id_map change, and a freshly trained model can be
+    installed directly. Each load builds a new recognizer and swaps the
+    (recognizer, rev_id_map) pair in a single assignment, so a request that
+    already holds the old pair keeps using a consistent model.
+    """
+
+    def __init__(self, model_file, storage):
+        self.model_file = model_file
+        self.storage = storage
+        self._lock = threading.Lock()
+        self._snapshot = None  # (recognizer, rev_id_map, stamp)
+
+    def _stamp(self):
+        try:
+            model_stamp = os.stat(self.model_file).st_mtime_ns
+        except OSError:
+            return None
+        id_map_stamp = self.storage.document_stamp('id_map')
+        return None if id_map_stamp is None else (model_stamp, id_map_stamp)
+
+    def get(self):
+        """Returns (recognizer, rev_id_map), or None if no trained model exists."""
+        stamp = self._stamp()
+        if stamp is None:
+            return None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[2] != stamp:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[2] != stamp:
+                    model = cv2.face.LBPHFaceRecognizer_create()
+                    model.read(self.model_file)
+                    id_map = self.storage.load_document('id_map', {})
+                    snapshot = (model, {v: k for k, v in id_map.items()}, stamp)
+                    self._snapshot = snapshot
+                    app.logger.info("Face recognition model loaded into memory")
+        return snapshot[0], snapshot[1]
+
+    def install(self, model, id_map):
+        """Swaps in a model that was just trained and written to disk."""
+        with self._lock:
+            self._snapshot = (model, {v: k for k, v in id_map.items()}, self._stamp())
+
+face_model = FaceModelCache(MODEL_FILE, storage)
 
 # --- Fingerprint Serial Connection ---
-fingerprint_serial = None
-fingerprint_queue = queue.Queue()
-fingerprint_connected = False
-fingerprint_enrollment_status = []  # Store real-time enrollment messages
-fingerprint_enrollment_active = False  # Flag to prevent attendance during enrollment
-fingerprint_sensor_activated = False  # Flag to track if sensor is activated for attendance
+fingerprint_queue = queue.Queue(maxsize=100)  # Processed matches waiting for /get_fingerprint_matches pollers
+FINGERPRINT_POLLER_TIMEOUT = 10  # Seconds after the last poll that matches are still queued for pollers
+fingerprint_last_poll = None  # time.monotonic() of the last /get_fingerprint_matches call
+
+# --- Fingerprint Event Stream ---
+FINGERPRINT_STREAM_HEARTBEAT = 15  # Seconds between keep-alive comments on idle streams
+
+class FingerprintEventBus:
+    """Fans fingerprint results out to every open /fingerprint_stream client."""
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass  # A stalled client loses events rather than blocking the listener
+
+fingerprint_events = FingerprintEventBus()
+
+# --- ESP32 Serial I/O Engine ---
+class SerialLineEngine:
+    """
+    Owns one ESP32 serial port. A single reader thread blocks on the port, frames
+    the byte stream into lines and dispatches each JSON message by its 'type':
+    callers waiting on a command response get it first, then subscribers.
+    Nothing else reads from the port, so commands never steal the listener's lines.
+    """
+
+    MAX_LINE_BYTES = 4096  # A line longer than this is noise; drop it instead of buffering forever
+
+    def __init__(self, ser, on_disconnect=None):
+        self.ser = ser
+        self.on_disconnect = on_disconnect
+        self.running = False
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._subscribers = {}  # message type ('*' for all) -> [callback]
+        self._waiters = []  # [(message types, queue)] registered by in-flight commands
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def stop(self):
+        """Stops the reader and closes the port, so a rescan can open it again."""
+        self.running = False
+        self._close()
+
+    def _close(self):
+        try:
+            self.ser.close()
+        except Exception as e:
+            app.logger.warning(f"Error closing serial port: {e}")
+
+    def subscribe(self, msg_types, callback):
+        with self._lock:
+            for msg_type in msg_types:
+                self._subscribers.setdefault(msg_type, []).append(callback)
+
+    def open_waiter(self, msg_types):
+        """Registers interest in a response before the command is sent, so a fast reply can't be missed."""
+        waiter = (frozenset(msg_types), queue.Queue())
+        with self._lock:
+            self._waiters.append(waiter)
+        return waiter
+
+    def close_waiter(self, waiter):
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def send(self, command):
+        if not self.running:
+            return False
+        with self._write_lock:
+            self.ser.write(f"{command}\n".encode())
+        return True
+
+    def request(self, command, response_types, timeout=5, matches=None):
+        """
+        Sends a command and returns the first message of one of response_types
+        (that also satisfies matches, e.g. the same slot id), or None on timeout.
+        """
+        waiter = self.open_waiter(response_types)
+        deadline = time.monotonic() + timeout
+        try:
+            if not self.send(command):
+                return None
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    data = waiter[1].get(timeout=remaining)
+                except queue.Empty:
+                    return None
+                if matches is None or matches(data):
+                    return data
+        finally:
+            self.close_waiter(waiter)
+
+    def _read_loop(self):
+        while self.running:
+            try:
+                # Blocks for up to the port timeout waiting for the first byte, then takes whatever has arrived
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                if not self.running:
+                    break  # stop() closed the port under us
+                app.logger.error(f"Fingerprint reader disconnected: {e}")
+                print(f"❌ Serial read error: {e}")
+                self.running = False
+                # Release the handle; Windows won't reopen a port that is still held
+                self._close()
+                if self.on_disconnect:
+                    self.on_disconnect()
+                break
+            if chunk:
+                self._frame(chunk)
+
+    def _frame(self, chunk):
+        self._buffer.extend(chunk)
+        while True:
+            end = self._buffer.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(self._buffer[:end])
+            del self._buffer[:end + 1]
+            self._dispatch(line)
+        if len(self._buffer) > self.MAX_LINE_BYTES:
+            app.logger.warning("Discarding unterminated serial data from ESP32")
+            self._buffer.clear()
+
+    def _dispatch(self, raw):
+        line = raw.decode('utf-8', errors='replace').strip()
+        if not line:
+            return
+        # Print to terminal for debugging
+        print(f"[ESP32 ← ] {line}")
+        try:
+            data = json.loads(line)
+        except json.JSONDecodeError:
+            app.logger.warning(f"Invalid JSON from ESP32: {line}")
+            return
+        if not isinstance(data, dict):
+            return
+        msg_type = data.get('type')
+        with self._lock:
+            waiters = [q for types, q in self._waiters if msg_type in types]
+            callbacks = self._subscribers.get(msg_type, []) + self._subscribers.get('*', [])
+        for waiter_queue in waiters:
+            waiter_queue.put(data)
+        for callback in callbacks:
+            try:
+                callback(data)
+            except Exception as e:
+                app.logger.error(f"Fingerprint listener error: {e}")
+                print(f"❌ Listener error: {e}")
 
 # --- Daily Attendance CSV Generation ---
 def generate_daily_attendance_csv():
@@ -75,15 +906,7 @@ def generate_daily_attendance_csv():
             return
         
         # Get all students and check if they were present today
-        attendance_file_today = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today_str}.csv")
-        present_students = set()
-        
-        if os.path.exists(attendance_file_today):
-            try:
-                daily_attendance_df = pd.read_csv(attendance_file_today, dtype={'Student ID': str})
-                present_students = set(daily_attendance_df['Student ID'].str.strip().unique())
-            except Exception as e:
-                app.logger.error(f"Error reading daily attendance: {e}")
+        present_students = attendance_ledger.present_ids(today_str)
         
         # Create daily CSV with all students
         daily_data = []
@@ -99,7 +922,7 @@ def generate_daily_attendance_csv():
             })
         
         daily_df = pd.DataFrame(daily_data)
-        daily_df.to_csv(daily_csv_file, index=False)
+        atomic_write(daily_csv_file, lambda f: daily_df.to_csv(f, index=False), newline='')
         app.logger.info(f"Daily attendance CSV generated: {daily_csv_file}")
     
     except Exception as e:
@@ -117,8 +940,10 @@ scheduler.add_job(
 
 # --- Helper Functions ---
 def load_users():
-    with open('users.json', 'r') as f:
-        return json.load(f)
+    return storage.load_document('users', [])
+
+def save_users(users):
+    storage.save_document('users', users)
     
 def normalize_phone(phone):
     phone = str(phone).strip()
@@ -143,23 +968,156 @@ def authenticate(username, password):
         if user['username'] == username and user['password'] == password:
             return user
     return None
+# --- Derived Columns ---
+# Whole-column versions of the per-row derivations, shared by the roster
+# store and the routes.
+PERFORMANCE_THRESHOLDS = [(50, 'At Risk'), (70, 'Average'), (85, 'Good')]  # Final score below -> label; otherwise Excellent
+AT_RISK_ATTENDANCE = 50  # Attendance percentage below which a scored student is At Risk regardless of score
+
+def day_counts(values):
+    """Day counts as ints: blanks and NaN become 0, and '3.0' or 3.7 become 3 as int(float(x)) would."""
+    numbers = pd.to_numeric(values, errors='coerce').fillna(0)
+    return np.trunc(numbers).astype(int)
+
+def attendance_percentages(days_present, total_days):
+    """days_present / total_days * 100 rounded to 2 places; 0.0 where total_days is 0."""
+    present = np.asarray(days_present, dtype=float)
+    total = np.asarray(total_days, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages = np.round((present / total) * 100, 2)
+    return np.where(total > 0, percentages, 0.0)
+
+def score_categories(scores):
+    """Category of each predicted final score; 'N/A' where there is none."""
+    scores = np.asarray(scores, dtype=float)
+    return np.select(
+        [np.isnan(scores)] + [scores < threshold for threshold, _ in PERFORMANCE_THRESHOLDS],
+        ['N/A'] + [label for _, label in PERFORMANCE_THRESHOLDS],
+        default='Excellent',
+    )
+
+def performance_categories(final_scores, attendance_percentage):
+    """Category of each student: like score_categories(), but low attendance makes a scored student At Risk."""
+    final_scores = np.asarray(final_scores, dtype=float)
+    attendance_percentage = np.asarray(attendance_percentage, dtype=float)
+    low_attendance = ~np.isnan(final_scores) & (attendance_percentage < AT_RISK_ATTENDANCE)
+    return np.where(low_attendance, 'At Risk', score_categories(final_scores))
+
+# --- In-Memory Roster Store ---
+class RosterStore:
+    """Process-wide copy of the student roster.
+
+    The roster is loaded from the storage backend once and kept in memory with
+    a student_id -> row index, so reads only check the backend's roster stamp
+    (to notice a write by another worker process). All changes go through
+    save(), which writes the roster atomically and swaps the cached table in
+    one step. Read-modify-write callers hold locked() from get_df() through
+    save_df() so concurrent edits are not lost.
+    """
+
+    EMPTY_COLUMNS = ['student_id', 'name', 'attendance_percentage', 'test_score_1', 'test_score_2', 'assignment_score', 'final_exam_score', 'performance_category']
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.version = 0  # Bumped on every change so caches can tell the roster moved
+        self._lock = threading.RLock()
+        self._file_lock = storage.lock('roster')
+        self._df = None
+        self._index = {}
+        self._stamp = None
+
+    def _read(self):
+        self._stamp = self.storage.roster_stamp()
+        df = self.storage.load_roster()
+        return df if df is not None else pd.DataFrame(columns=self.EMPTY_COLUMNS)
+
+    def _install(self, df):
+        """Normalizes df and makes it the cached roster. Caller holds the lock."""
+        df = df.reset_index(drop=True)
+        df['student_id'] = df['student_id'].astype(str).str.strip()
+        # Fix blank total_days for any student
+        if 'total_days' in df.columns:
+            df['total_days'] = day_counts(df['total_days'])
+        self._df = df.infer_objects()
+        self._index = {sid: pos for pos, sid in enumerate(self._df['student_id'])}
+        self.version += 1
+
+    def _ensure_loaded(self):
+        if self._df is None or self.storage.roster_stamp() != self._stamp:
+            self._install(self._read())
+
+    def locked(self):
+        """Lock to hold across a read-modify-write of the roster."""
+        return self._file_lock
+
+    def frame(self):
+        """Returns a private copy of the roster that the caller may modify."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._df.copy()
+
+    def current_version(self):
+        """The version of the roster as it is in storage now (reloaded first if another process changed it)."""
+        with self._lock:
+            self._ensure_loaded()
+            return self.version
+
+    def snapshot(self):
+        """Returns (version, private copy of the roster), taken together."""
+        with self._lock:
+            self._ensure_loaded()
+            return self.version, self._df.copy()
+
+    def get(self, student_id):
+        """Returns one student's row as a dict, or None if the ID is unknown."""
+        with self._lock:
+            self._ensure_loaded()
+            pos = self._index.get(str(student_id).strip())
+            if pos is None:
+                return None
+            return self._df.iloc[pos].to_dict()
+
+    def name_of(self, student_id):
+        student = self.get(student_id)
+        return student['name'] if student else None
+
+    def contains(self, student_id):
+        with self._lock:
+            self._ensure_loaded()
+            return str(student_id).strip() in self._index
+
+    def ids(self):
+        with self._lock:
+            self._ensure_loaded()
+            return list(self._index)
+
+    def names(self):
+        """Returns a {student_id: name} dict for the whole roster."""
+        with self._lock:
+            self._ensure_loaded()
+            return dict(zip(self._df['student_id'], self._df['name']))
+
+    def save(self, df):
+        """Writes df to storage and makes it the cached roster."""
+        with self._file_lock, self._lock:
+            self.storage.save_roster(df)
+            self._stamp = self.storage.roster_stamp()
+            self._install(df.copy())
+
+    def reload(self):
+        """Drops the cached roster so the next read loads it from storage again."""
+        with self._lock:
+            self._df = None
+            self._index = {}
+
+roster_store = RosterStore(storage)
+
 def get_df():
-    """Loads student data, critically ensuring 'student_id' is treated as a string."""
-    try:
-        if os.path.exists(DATA_FILE) and os.path.getsize(DATA_FILE) > 0:
-            # This dtype={'student_id': str} is essential for alphanumeric IDs.
-            df = pd.read_csv(DATA_FILE, dtype={'student_id': str})
-            df['student_id'] = df['student_id'].str.strip()
-            # Fix blank total_days for any student
-            if 'total_days' in df.columns:
-                df['total_days'] = df['total_days'].apply(lambda x: 0 if pd.isna(x) or x == '' else int(float(x)))
-            return df
-    except Exception as e:
-        app.logger.error(f"Error loading CSV: {e}")
-    return pd.DataFrame(columns=['student_id', 'name', 'attendance_percentage', 'test_score_1', 'test_score_2', 'assignment_score', 'final_exam_score', 'performance_category'])
+    """Returns a copy of the cached student data; 'student_id' is always a string."""
+    return roster_store.frame()
 
-def save_df(df):
-    """Saves the DataFrame to the CSV file."""
+def _derive_attendance_columns(df):
+    """Fills days_present/total_days and recomputes attendance_percentage in place."""
     # Ensure required columns exist and are filled
     if 'days_present' not in df.columns:
         df['days_present'] = 0
@@ -167,254 +1125,791 @@ def save_df(df):
         df['total_days'] = 0
     df['days_present'] = df['days_present'].fillna(0).astype(int)
     df['total_days'] = df['total_days'].fillna(0).astype(int)
-    if not df.empty:
-        df['attendance_percentage'] = df.apply(
-            lambda row: round((int(row['days_present']) / int(row['total_days'])) * 100, 2) if int(row['total_days']) > 0 else 0.0, axis=1
-        )
-    else:
-        df['attendance_percentage'] = []
-    df.to_csv(DATA_FILE, index=False)
+    df['attendance_percentage'] = attendance_percentages(df['days_present'], df['total_days'])
+    return df
+
+def save_df(df):
+    """Saves the DataFrame to storage and refreshes the cached roster."""
+    _derive_attendance_columns(df)
+    roster_store.save(df)
+
+# --- Attendance Ledger ---
+class AttendanceLedger:
+    """Attendance marks in the storage backend, with an incremental presence index.
+
+    With CSV storage every mark is one row in ledger.csv (and, as before, in
+    that day's attendance_YYYY-MM-DD.csv); with SQLite it is one row of the
+    attendance table. The marks are read once at startup; after that
+    per-student presence counts, per-day present sets and the number of
+    recorded days are kept up to date in memory, so percentages and
+    "present today" never require re-reading attendance history. If another
+    worker process writes marks, the index is rebuilt on the next read.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.version = 0
+        self._lock = threading.RLock()
+        self._file_lock = storage.lock('attendance')
+        self._loaded = False
+        self._stamp = None
+        self._days = set()
+        self._present_by_day = {}
+        self._presence_counts = {}
+        self._events_by_day = {}  # Full rows, kept only for days read or marked while running
+
+    def _reset_index(self):
+        self._days = set()
+        self._present_by_day = {}
+        self._presence_counts = {}
+        self._events_by_day = {}
+
+    def _apply(self, day, student_id):
+        """Adds one mark to the index. Returns False if it was a duplicate."""
+        self._days.add(day)
+        present = self._present_by_day.setdefault(day, set())
+        if student_id in present:
+            return False
+        present.add(student_id)
+        self._presence_counts[student_id] = self._presence_counts.get(student_id, 0) + 1
+        return True
+
+    def _ensure_loaded(self):
+        if self._loaded and self._stamp == self.storage.attendance_stamp():
+            return
+        self._reset_index()
+        for day, student_id in self.storage.load_marks():
+            if student_id:
+                self._apply(day, student_id)
+        # Days that were opened but have no marks yet still count towards total_days
+        self._days.update(self.storage.load_days())
+        self._loaded = True
+        self._stamp = self.storage.attendance_stamp()
+        self.version += 1
+
+    def open_day(self, day):
+        """Registers a day as a class day in storage (a daily file for CSV).
+
+        Returns True only when the day was not known before.
+        """
+        with self._lock:
+            self._ensure_loaded()
+            if day in self._days:
+                return False
+        with self._file_lock, self._lock:
+            self._ensure_loaded()
+            if day in self._days:
+                return False
+            self.storage.add_day(day)
+            self._days.add(day)
+            self._stamp = self.storage.attendance_stamp()
+            self.version += 1
+            return True
+
+    def mark(self, student_id, name, day=None, time_str=None):
+        """Records a mark. Returns False if the student was already present that day."""
+        day = day or datetime.date.today().strftime("%Y-%m-%d")
+        time_str = time_str or datetime.datetime.now().strftime("%H:%M:%S")
+        return self.mark_many([(student_id, name, day, time_str)])[0]
+
+    def mark_many(self, marks):
+        """Records (student_id, name, day, time) marks with one storage write.
+
+        Returns one bool per mark; False means the student was already present
+        that day (including earlier in the same batch).
+        """
+        results = []
+        rows_by_day = {}
+        with self._file_lock, self._lock:
+            for student_id, name, day, time_str in marks:
+                student_id = str(student_id).strip()
+                self.open_day(day)
+                pending = rows_by_day.setdefault(day, [])
+                if student_id in self._present_by_day.get(day, ()) or any(row[0] == student_id for row in pending):
+                    results.append(False)
+                    continue
+                pending.append([student_id, name, time_str])
+                results.append(True)
+            rows_by_day = {day: rows for day, rows in rows_by_day.items() if rows}
+            if not rows_by_day:
+                return results
+            for day in rows_by_day:
+                self.events(day)  # Cache the day's existing rows before appending to them
+            self.storage.append_marks(rows_by_day)
+            for day, rows in rows_by_day.items():
+                for student_id, name, time_str in rows:
+                    self._apply(day, student_id)
+                    self._events_by_day.setdefault(day, []).append({'Student ID': student_id, 'Name': name, 'Time': time_str})
+            self._stamp = self.storage.attendance_stamp()
+            self.version += 1
+            return results
+
+    def current_version(self):
+        """The ledger version as of now (the index is rebuilt first if another process wrote marks)."""
+        with self._lock:
+            self._ensure_loaded()
+            return self.version
+
+    def is_present(self, student_id, day):
+        with self._lock:
+            self._ensure_loaded()
+            return str(student_id).strip() in self._present_by_day.get(day, ())
+
+    def present_ids(self, day):
+        with self._lock:
+            self._ensure_loaded()
+            return set(self._present_by_day.get(day, ()))
+
+    def events(self, day):
+        """Returns the day's rows ('Student ID', 'Name', 'Time') in the order they were marked."""
+        with self._lock:
+            self._ensure_loaded()
+            if day not in self._events_by_day:
+                self._events_by_day[day] = self.storage.day_events(day)
+            return list(self._events_by_day[day])
+
+    def days(self):
+        with self._lock:
+            self._ensure_loaded()
+            return sorted(self._days)
+
+    def total_days(self):
+        with self._lock:
+            self._ensure_loaded()
+            return len(self._days)
+
+    def days_present(self, student_id):
+        with self._lock:
+            self._ensure_loaded()
+            return self._presence_counts.get(str(student_id).strip(), 0)
+
+    def streak(self, student_id, today):
+        """Counts consecutive recorded days, ending today, that the student attended."""
+        student_id = str(student_id).strip()
+        streak = 0
+        expected_date = today
+        with self._lock:
+            self._ensure_loaded()
+            for day in sorted(self._days, reverse=True):
+                # Only count streak if the day is the expected consecutive date
+                if day != expected_date.strftime("%Y-%m-%d"):
+                    break
+                if student_id not in self._present_by_day.get(day, ()):
+                    break
+                streak += 1
+                expected_date -= datetime.timedelta(days=1)
+        return streak
+
+    def percentages(self, student_ids):
+        """Returns attendance percentages for student_ids, in the same order."""
+        with self._lock:
+            self._ensure_loaded()
+            total_days = len(self._days)
+            if total_days == 0:
+                return [0.0 for _ in student_ids]
+            return [round((self._presence_counts.get(sid, 0) / total_days) * 100, 2) for sid in student_ids]
+
+    def history(self, start=None, end=None, columns=None):
+        """Marks dated start..end (inclusive YYYY-MM-DD) as a DataFrame, reading only the given columns.
+
+        Unlike the index, this goes to storage: it is meant for reports over
+        long ranges of history, not for per-request checks.
+        """
+        with self._lock:
+            return self.storage.scan_marks(columns, start, end)
+
+    def compact(self, before_day=None):
+        """Rolls the days before before_day (YYYY-MM-DD, at most today; default today) into the storage archive."""
+        today = datetime.date.today().strftime("%Y-%m-%d")
+        before_day = before_day or today
+        # Days are compared as strings, and today's daily file must stay open
+        if datetime.date.fromisoformat(before_day).isoformat() != before_day:
+            raise ValueError(f"Expected a YYYY-MM-DD date, got '{before_day}'")
+        if before_day > today:
+            raise ValueError(f"Cannot archive days from today on (got {before_day})")
+        with self._file_lock, self._lock:
+            self._ensure_loaded()
+            archived = self.storage.compact_attendance(before_day)
+            # Same marks in a new layout, so the index stays valid; only the stamp moved
+            self._stamp = self.storage.attendance_stamp()
+            return archived
+
+    def remove_student(self, student_id):
+        """Drops every mark of a student from storage (the ledger and the daily files for CSV)."""
+        student_id = str(student_id).strip()
+        with self._file_lock, self._lock:
+            self._ensure_loaded()
+            self.storage.remove_student_marks(student_id)
+            self._loaded = False
+            self._ensure_loaded()
+
+attendance_ledger = AttendanceLedger(storage)
+
+def compact_attendance_archive():
+    """Scheduled job: moves every closed day into the columnar archive; today stays in the ledger."""
+    try:
+        archived = attendance_ledger.compact()
+        if archived:
+            app.logger.info(f"Attendance archive compacted: {archived[0]} to {archived[-1]}")
+    except Exception as e:
+        app.logger.error(f"Error compacting attendance archive: {e}")
+
+scheduler.add_job(
+    func=compact_attendance_archive,
+    trigger=CronTrigger(hour=0, minute=30),  # Run at 12:30 AM daily, after the day has closed
+    id='attendance_compaction_job',
+    name='Compact closed attendance days',
+    replace_existing=True
+)
 
 def _update_attendance_percentages(df):
-    if df.empty or not os.path.exists(ATTENDANCE_FOLDER):
+    if df.empty:
         if 'attendance_percentage' not in df.columns:
             df['attendance_percentage'] = 0.0
         return df
-        
-    attendance_files = glob.glob(os.path.join(ATTENDANCE_FOLDER, 'attendance_*.csv'))
-    total_days = len(attendance_files)
-    
     df['student_id'] = df['student_id'].astype(str)
-    presence_counts = {student_id: 0 for student_id in df['student_id']}
-
-    for file_path in attendance_files:
-        try:
-            daily_df = pd.read_csv(file_path, dtype={'Student ID': str})
-            for student_id in daily_df['Student ID'].str.strip().dropna().unique():
-                if student_id in presence_counts:
-                    presence_counts[student_id] += 1
-        except Exception: continue
-
-    if total_days > 0:
-        df['attendance_percentage'] = df['student_id'].apply(
-            lambda sid: round((presence_counts.get(sid, 0) / total_days) * 100, 2)
-        )
-    else:
-        df['attendance_percentage'] = 0.0
+    df['attendance_percentage'] = attendance_ledger.percentages(df['student_id'].tolist())
     return df
 
 def _get_total_attendance_days():
     """Calculates the total number of unique days attendance has been recorded."""
-    if not os.path.exists(ATTENDANCE_FOLDER):
-        return 0
-    # Glob returns a list of all files matching the pattern
-    attendance_files = glob.glob(os.path.join(ATTENDANCE_FOLDER, 'attendance_*.csv'))
-    # The number of files corresponds to the total number of days recorded
-    return len(attendance_files) 
+    return attendance_ledger.total_days()
+
+def _already_present(student_id):
+    student = roster_store.get(student_id)
+    return {'status': 'already_present', 'percentage': student['attendance_percentage'] if student else 0.0}
 
 def mark_attendance(student_id, name):
     student_id_str = str(student_id).strip()
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    now_str = datetime.datetime.now().strftime("%H:%M:%S")
-    attendance_file_path = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today_str}.csv")
-    already_marked = False
-    if os.path.exists(attendance_file_path):
-        try:
-            daily_df = pd.read_csv(attendance_file_path, dtype={'Student ID': str})
-            if student_id_str in daily_df['Student ID'].str.strip().values:
-                already_marked = True
-        except (pd.errors.EmptyDataError, KeyError): pass
-    df = get_df()
-    student_index = df.index[df['student_id'] == student_id_str].tolist()
-
-    # --- NEW LOGIC: total_days always equals number of attendance files ---
-    attendance_files = glob.glob(os.path.join(ATTENDANCE_FOLDER, 'attendance_*.csv'))
-    total_days_count = len(attendance_files)
-    # If no attendance files, reset total_days to 0
-    if total_days_count == 0:
-        df['total_days'] = 0
-    else:
-        df['total_days'] = total_days_count
-
-    if not already_marked:
-        new_entry = pd.DataFrame([{'Student ID': student_id_str, 'Name': name, 'Time': now_str}])
-        new_entry.to_csv(attendance_file_path, mode='a', header=not os.path.exists(attendance_file_path), index=False)
-        if student_index:
-            idx = student_index[0]
-            df.loc[idx, 'days_present'] = int(float(df.loc[idx, 'days_present'])) if not pd.isna(df.loc[idx, 'days_present']) else 0
-            df.loc[idx, 'days_present'] += 1
-            df['attendance_percentage'] = df.apply(
-                lambda row: round((row['days_present'] / row['total_days']) * 100, 2) if row['total_days'] > 0 else 0.0, axis=1
-            )
+    # Repeat scans are answered from the in-memory present set without queueing a write
+    if attendance_ledger.is_present(student_id_str, datetime.date.today().strftime("%Y-%m-%d")):
+        return _already_present(student_id_str)
+    return attendance_pipeline.submit(student_id_str, name)
+
+def _commit_attendance_batch(batch):
+    """Writes a batch of marks with one ledger append and one roster flush; returns each mark's status."""
+    stats_key = dashboard_stats.key()
+    marked = attendance_ledger.mark_many([(m['student_id'], m['name'], m['day'], m['time']) for m in batch])
+    new_ids = [m['student_id'] for m, ok in zip(batch, marked) if ok and roster_store.contains(m['student_id'])]
+    if new_ids:
+        with roster_store.locked():
+            df = get_df()
+            # total_days always equals the number of recorded attendance days
+            df['total_days'] = attendance_ledger.total_days()
+            if 'days_present' not in df.columns:
+                df['days_present'] = 0
+            days_present = pd.to_numeric(df['days_present'], errors='coerce').fillna(0).astype(int)
+            df['days_present'] = days_present + df['student_id'].map(pd.Series(new_ids).value_counts()).fillna(0).astype(int)
             save_df(df)
-            return {'status': 'marked', 'percentage': df.loc[idx, 'attendance_percentage']}
-        else:
-            return {'status': 'not_found', 'percentage': 0.0}
-    elif already_marked:
-        if student_index:
-            idx = student_index[0]
-            return {'status': 'already_present', 'percentage': df.loc[idx, 'attendance_percentage']}
+    try:
+        dashboard_stats.apply_marks([m for m, ok in zip(batch, marked) if ok], stats_key, roster_saved=bool(new_ids))
+    except Exception as e:
+        # The marks are already on disk; the stats are simply rebuilt on the next poll
+        app.logger.error(f"Error updating dashboard stats: {e}")
+        dashboard_stats.invalidate()
+
+    results = []
+    for mark, ok in zip(batch, marked):
+        student = roster_store.get(mark['student_id'])
+        if not ok:
+            results.append(_already_present(mark['student_id']))
+        elif student is None:
+            results.append({'status': 'not_found', 'percentage': 0.0})
         else:
-            return {'status': 'already_present', 'percentage': 0.0}
+            results.append({'status': 'marked', 'percentage': student['attendance_percentage']})
+    return results
+
+# --- Attendance Commit Pipeline ---
+ATTENDANCE_BATCH_SIZE = 64  # Most marks committed together
+ATTENDANCE_BATCH_WINDOW = 0.05  # Seconds the committer waits for more marks after the first one
+ATTENDANCE_COMMIT_TIMEOUT = 30  # Seconds submit() waits for its mark before giving up
+
+class AttendanceCommitPipeline:
+    """Funnels attendance marks through one committer thread.
+
+    During a burst of arrivals, marks that come in within ATTENDANCE_BATCH_WINDOW
+    of each other are committed together: one ledger append, one roster rewrite
+    and one fsync per file, instead of one full roster rewrite per scan.
+    submit() still blocks until the caller's own mark is on disk and returns
+    its status. If the committer is stuck (e.g. on a file lock another process
+    holds), it raises TimeoutError after ATTENDANCE_COMMIT_TIMEOUT instead, and
+    a mark the committer has not taken yet is withdrawn.
+    """
+
+    def __init__(self, commit, max_batch=ATTENDANCE_BATCH_SIZE, window=ATTENDANCE_BATCH_WINDOW,
+                 timeout=ATTENDANCE_COMMIT_TIMEOUT):
+        self.commit = commit
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._claim_lock = threading.Lock()  # Settles a timed-out mark against the committer taking it
+        self._thread = None
+
+    def submit(self, student_id, name):
+        now = datetime.datetime.now()
+        mark = {
+            'student_id': student_id,
+            'name': name,
+            'day': now.strftime("%Y-%m-%d"),
+            'time': now.strftime("%H:%M:%S"),
+            'done': threading.Event(),
+            'taken': False,
+            'withdrawn': False,
+            'result': None,
+            'error': None,
+        }
+        self._ensure_started()
+        self._queue.put(mark)
+        if not mark['done'].wait(self.timeout):
+            with self._claim_lock:
+                mark['withdrawn'] = not mark['taken']
+            app.logger.error(f"Attendance commit for {student_id} timed out after {self.timeout}s")
+            state = 'was not written' if mark['withdrawn'] else 'may still be written'
+            raise TimeoutError(f"Attendance for {student_id} was not committed within {self.timeout}s; it {state}")
+        if mark['error'] is not None:
+            raise mark['error']
+        return mark['result']
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name='attendance-committer')
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            with self._claim_lock:
+                batch = [mark for mark in batch if not mark['withdrawn']]
+                for mark in batch:
+                    mark['taken'] = True
+            if not batch:
+                continue
+            try:
+                for mark, result in zip(batch, self.commit(batch)):
+                    mark['result'] = result
+            except Exception as e:
+                app.logger.error(f"Error committing {len(batch)} attendance marks: {e}")
+                for mark in batch:
+                    mark['error'] = e
+            for mark in batch:
+                mark['done'].set()
+
+attendance_pipeline = AttendanceCommitPipeline(_commit_attendance_batch)
 
 # --- Fingerprint Helper Functions ---
-def find_esp32_port():
-    """Auto-detect ESP32 port"""
+def find_esp32_ports():
+    """Auto-detect every connected ESP32 port"""
     ports = serial.tools.list_ports.comports()
-    for port in ports:
-        if ('303A' in port.hwid or 'CP210' in port.hwid or 'CH340' in port.hwid or 'USB Serial' in port.description):
-            return port.device
-    return None
+    return [port for port in ports
+            if ('303A' in port.hwid or 'CP210' in port.hwid or 'CH340' in port.hwid or 'USB Serial' in port.description)]
+
+# Messages the ESP32 emits while an enrollment is running
+FINGERPRINT_ENROLLMENT_MESSAGES = ['status', 'prompt', 'info', 'error', 'enrolled']
+
+class FingerprintSensor:
+    """One ESP32/R307 reader: its serial engine, its own slot namespace and its health."""
+
+    def __init__(self, sensor_id, port):
+        self.sensor_id = sensor_id
+        self.port = port
+        self.engine = None
+        self.connected = False
+        self.enrolling = False  # Matches from this sensor are ignored while it enrolls
+        self.activated = False  # Matches only mark attendance while the sensor is activated
+        self.connected_at = None
+        self.last_message_at = None
+        self.last_error = None
+        self.matches = 0
+
+    def connect(self):
+        ser = serial.Serial(self.port, 115200, timeout=1)
+        time.sleep(2)
+        self.engine = SerialLineEngine(ser, on_disconnect=self._on_disconnect)
+        self.engine.subscribe(['*'], self._on_message)
+        self.engine.subscribe(['match'], lambda data: fingerprint_listener(self, data))
+        self.engine.subscribe(FINGERPRINT_ENROLLMENT_MESSAGES, _log_fingerprint_message)
+        self.engine.start()
+        self.connected = True
+        self.enrolling = False
+        self.last_error = None
+        self.connected_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # The 'count' reply carries the reader's capacity (see _on_message)
+        self.engine.send("COUNT")
+
+    def _on_message(self, data):
+        self.last_message_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # 'info', 'count' and 'sensor_status' messages report how many templates the reader holds
+        capacity = data.get('capacity')
+        if isinstance(capacity, int) and capacity > 0 and self.sensor_id not in FINGERPRINT_SENSOR_CAPACITIES:
+            fingerprint_slots.set_capacity(self.sensor_id, capacity)
+
+    def _on_disconnect(self):
+        if self.engine:
+            self.engine.stop()
+        self.connected = False
+        self.enrolling = False
+        self.last_error = 'Serial connection lost'
+
+    def send(self, command):
+        print(f"[ESP32 {self.sensor_id} →] {command}")
+        app.logger.info(f"Sent command to ESP32 {self.sensor_id}: {command}")
+        return self.engine.send(command)
+
+    def request(self, command, response_types, timeout=5, matches=None):
+        print(f"[ESP32 {self.sensor_id} →] {command}")
+        app.logger.info(f"Sent command to ESP32 {self.sensor_id}: {command}")
+        return self.engine.request(command, response_types, timeout=timeout, matches=matches)
+
+    def health(self):
+        return {
+            'sensor_id': self.sensor_id,
+            'port': self.port,
+            'connected': self.connected,
+            'enrolling': self.enrolling,
+            'activated': self.activated,
+            'connected_at': self.connected_at,
+            'last_message_at': self.last_message_at,
+            'last_error': self.last_error,
+            'matches': self.matches,
+            'enrolled': fingerprint_slots.count(self.sensor_id),
+            'capacity': fingerprint_slots.capacity_of(self.sensor_id),
+        }
+
+class FingerprintHub:
+    """Every ESP32 reader attached to this server, all feeding the same attendance pipeline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sensors = {}  # sensor_id -> FingerprintSensor, in discovery order
+
+    def discover(self):
+        """Connects readers that are new or were unplugged; returns how many are connected."""
+        for port in find_esp32_ports():
+            # The USB serial number survives re-plugging into another port
+            sensor_id = port.serial_number or port.device
+            with self._lock:
+                sensor = self.sensors.get(sensor_id)
+                if sensor is None:
+                    sensor = self.sensors[sensor_id] = FingerprintSensor(sensor_id, port.device)
+                elif sensor.connected:
+                    continue
+                sensor.port = port.device
+            try:
+                sensor.connect()
+                app.logger.info(f"Fingerprint reader {sensor_id} connected on {port.device}")
+                print(f"🎧 Fingerprint listener started for {sensor_id}")
+                # Mappings saved before readers were told apart belong to the first one
+                fingerprint_slots.adopt_legacy(sensor_id)
+            except Exception as e:
+                sensor.last_error = str(e)
+                app.logger.error(f"Error connecting to fingerprint reader on {port.device}: {e}")
+        return len(self.connected_sensors())
+
+    @property
+    def connected(self):
+        return any(sensor.connected for sensor in list(self.sensors.values()))
+
+    def connected_sensors(self):
+        return [sensor for sensor in list(self.sensors.values()) if sensor.connected]
+
+    def get(self, sensor_id):
+        """The sensor if it is connected, else None."""
+        sensor = self.sensors.get(sensor_id)
+        return sensor if sensor is not None and sensor.connected else None
+
+    def status(self):
+        return [sensor.health() for sensor in list(self.sensors.values())]
+
+fingerprint_hub = FingerprintHub()
+FINGERPRINT_RESCAN_INTERVAL = 30  # Seconds between looks for new or re-plugged readers
 
 def init_fingerprint_connection():
-    """Initialize connection to ESP32 fingerprint reader"""
-    global fingerprint_serial, fingerprint_connected
+    """Initialize connections to every ESP32 fingerprint reader"""
     try:
-        port = find_esp32_port()
-        if port:
-            fingerprint_serial = serial.Serial(port, 115200, timeout=1)
-            time.sleep(2)
-            fingerprint_connected = True
-            app.logger.info(f"Fingerprint reader connected on {port}")
-            # Start listener thread
-            threading.Thread(target=fingerprint_listener, daemon=True).start()
-            return True
+        connected = fingerprint_hub.discover()
     except Exception as e:
-        app.logger.error(f"Error connecting to fingerprint reader: {e}")
-        fingerprint_connected = False
-    return False
-
-def fingerprint_listener():
-    """Background thread to listen for fingerprint scans"""
-    global fingerprint_serial, fingerprint_queue, fingerprint_enrollment_status, fingerprint_enrollment_active
-    print("🎧 Fingerprint listener started")
-    
-    while fingerprint_connected and fingerprint_serial:
-        try:
-            if fingerprint_serial.in_waiting:
-                line = fingerprint_serial.readline().decode('utf-8').strip()
-                if line:
-                    # Print to terminal for debugging
-                    print(f"[ESP32 ← ] {line}")
-                    try:
-                        data = json.loads(line)
-                        msg_type = data.get('type')
-                        
-                        # Handle attendance matches - but only if NOT in enrollment mode
-                        if msg_type == 'match':
-                            if fingerprint_enrollment_active:
-                                print(f"🔍 MATCH DETECTED during enrollment - IGNORING (enrollment active)")
-                                continue  # Skip processing match messages during enrollment
-                            print(f"🔍 MATCH DETECTED! Adding to queue...")
-                            fingerprint_queue.put(data)
-                            print(f"✅ Match added to queue (size: {fingerprint_queue.qsize()})")
-                        
-                        # Handle enrollment messages (status, prompt, info, error, enrolled)
-                        elif msg_type in ['status', 'prompt', 'info', 'error', 'enrolled']:
-                            msg_text = data.get('message', '')
-                            fingerprint_enrollment_status.append({
-                                'type': msg_type,
-                                'message': msg_text
-                            })
-                            # Also print to terminal with emoji
-                            if msg_type == 'prompt':
-                                print(f"         └─ 👆 {msg_text}")
-                            elif msg_type == 'status':
-                                print(f"         └─ ℹ️  {msg_text}")
-                            elif msg_type == 'info':
-                                print(f"         └─ 💡 {msg_text}")
-                            elif msg_type == 'error':
-                                print(f"         └─ ❌ {msg_text}")
-                            elif msg_type == 'enrolled':
-                                print(f"         └─ ✅ {msg_text}")
-                                
-                    except json.JSONDecodeError:
-                        app.logger.warning(f"Invalid JSON from ESP32: {line}")
-        except Exception as e:
-            app.logger.error(f"Fingerprint listener error: {e}")
-            print(f"❌ Listener error: {e}")
-        time.sleep(0.1)  # Small delay to prevent CPU hogging
-
-def send_fingerprint_command(command):
-    """Send command to ESP32"""
-    global fingerprint_serial
-    if fingerprint_serial and fingerprint_connected:
+        app.logger.error(f"Error connecting to fingerprint readers: {e}")
+        connected = 0
+    if not scheduler.running:
+        scheduler.start()
+    scheduler.add_job(
+        func=fingerprint_hub.discover,
+        trigger='interval',
+        seconds=FINGERPRINT_RESCAN_INTERVAL,
+        id='fingerprint_rescan',
+        name='Discover fingerprint readers',
+        replace_existing=True
+    )
+    return connected > 0
+
+def fingerprint_listener(sensor, data):
+    """Handles a 'match' message from an ESP32 (runs on that sensor's reader thread)"""
+    # Handle attendance matches - but only if this sensor is NOT in enrollment mode
+    if sensor.enrolling:
+        print(f"🔍 MATCH DETECTED on {sensor.sensor_id} during enrollment - IGNORING (enrollment active)")
+        return
+    if not sensor.activated:
+        print(f"🔍 MATCH DETECTED on {sensor.sensor_id} but sensor not activated - IGNORING")
+        return
+    print(f"🔍 MATCH DETECTED on {sensor.sensor_id}! Resolving student...")
+    sensor.matches += 1
+    match_info = _process_fingerprint_match(sensor.sensor_id, data)
+    if match_info:
+        fingerprint_events.publish(match_info)
+        # Only queue for pollers while one is polling; nobody else drains the queue
+        last_poll = fingerprint_last_poll
+        if last_poll is not None and time.monotonic() - last_poll < FINGERPRINT_POLLER_TIMEOUT:
+            _put_latest(fingerprint_queue, match_info)
+
+def _log_fingerprint_message(data):
+    """Prints status/prompt/info/error/enrolled messages to the terminal with an emoji"""
+    msg_type = data.get('type')
+    msg_text = data.get('message', '')
+    if msg_type == 'prompt':
+        print(f"         └─ 👆 {msg_text}")
+    elif msg_type == 'status':
+        print(f"         └─ ℹ️  {msg_text}")
+    elif msg_type == 'info':
+        print(f"         └─ 💡 {msg_text}")
+    elif msg_type == 'error':
+        print(f"         └─ ❌ {msg_text}")
+    elif msg_type == 'enrolled':
+        print(f"         └─ ✅ {msg_text}")
+
+def send_fingerprint_command(command, sensor_id=None):
+    """Send command to one ESP32, or to every connected one when sensor_id is None"""
+    sensors = fingerprint_hub.connected_sensors() if sensor_id is None else [fingerprint_hub.get(sensor_id)]
+    sent = False
+    for sensor in sensors:
+        if sensor is None:
+            continue
         try:
-            # Print to terminal for debugging
-            print(f"[ESP32 →] {command}")
-            fingerprint_serial.write(f"{command}\n".encode())
-            app.logger.info(f"Sent command to ESP32: {command}")
-            return True
+            sent = sensor.send(command) or sent
         except Exception as e:
-            app.logger.error(f"Error sending command: {e}")
-    return False
+            app.logger.error(f"Error sending command to {sensor.sensor_id}: {e}")
+    return sent
 
-def read_fingerprint_response(timeout=30):
-    """Read response from ESP32"""
-    global fingerprint_serial
-    if not fingerprint_serial or not fingerprint_connected:
+def request_fingerprint_response(sensor_id, command, response_types, timeout=5, matches=None):
+    """Send command to an ESP32 and wait for its reply (the first message of one of response_types)"""
+    sensor = fingerprint_hub.get(sensor_id)
+    if sensor is None:
         return None
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        try:
-            if fingerprint_serial.in_waiting:
-                line = fingerprint_serial.readline().decode('utf-8').strip()
-                if line:
-                    # Print to terminal for debugging
-                    print(f"[ESP32 ← ] {line}")
-                    try:
-                        data = json.loads(line)
-                        # Log the parsed data type
-                        msg_type = data.get('type', 'unknown')
-                        msg_text = data.get('message', data.get('id', ''))
-                        print(f"         └─ Type: {msg_type}, Content: {msg_text}")
-                        return data
-                    except json.JSONDecodeError:
-                        app.logger.warning(f"Invalid JSON in response: {line}")
-        except Exception as e:
-            app.logger.error(f"Error reading response: {e}")
-        time.sleep(0.1)
+    try:
+        return sensor.request(command, response_types, timeout=timeout, matches=matches)
+    except Exception as e:
+        app.logger.error(f"Error sending command to {sensor_id}: {e}")
     return None
 
+def delete_fingerprint_from_sensor(sensor_id, slot, timeout=5):
+    """Delete a slot on a sensor; returns the ESP32's 'delete' reply for that slot, or None"""
+    return request_fingerprint_response(sensor_id, f"DELETE:{slot}", ['delete'], timeout=timeout,
+                                        matches=lambda data: data.get('id') == slot)
+
+# --- Fingerprint Slot Registry ---
+FINGERPRINT_SLOT_CAPACITY = 200  # R307S supports up to 200 fingerprints
+
+def _configured_sensor_capacities():
+    """sensor_id -> slots from TRACQUE_SENSOR_CAPACITIES, a JSON object such as '{"<serial number>": 1000}'."""
+    raw = os.environ.get('TRACQUE_SENSOR_CAPACITIES', '').strip()
+    if not raw:
+        return {}
+    try:
+        return {str(sensor_id): int(slots) for sensor_id, slots in json.loads(raw).items()}
+    except (ValueError, TypeError, AttributeError) as e:
+        app.logger.error(f"Ignoring invalid TRACQUE_SENSOR_CAPACITIES: {e}")
+        return {}
+
+# sensor_id -> slots. Readers not listed here use the capacity they report, or an R307's until they do.
+FINGERPRINT_SENSOR_CAPACITIES = _configured_sensor_capacities()
+
+class FingerprintSlotRegistry:
+    """
+    student_id <-> (sensor, slot), kept in memory both ways with a min-heap of
+    free slots per sensor, so a match never has to read storage. It is
+    reloaded when the fingerprint stamp shows another worker wrote the map,
+    and every change is made under storage.lock('fingerprints') on a fresh
+    copy and written back atomically.
+
+    Entries written before there were several readers are plain slot numbers;
+    they are kept under sensor None until adopt_legacy() gives them a sensor.
+
+    Each sensor has its own capacity, so a cohort larger than one sensor holds
+    is spread over several by allocate().
+    """
+
+    def __init__(self, storage, capacity=FINGERPRINT_SLOT_CAPACITY, capacities=None):
+        self.storage = storage
+        self.capacity = capacity
+        self.capacities = dict(capacities or {})
+        self._lock = threading.RLock()
+        self._file_lock = storage.lock('fingerprints')
+        self._slot_by_student = {}  # student_id -> (sensor_id, slot)
+        self._student_by_slot = {}  # (sensor_id, slot) -> student_id
+        self._counts = {}  # sensor_id -> enrolled templates
+        self._free = {}  # sensor_id -> heap of free slots; may hold stale entries that were assigned explicitly
+        self._stamp = None
+        self._loaded = False
+
+    def _load(self):
+        with self._lock:
+            self._stamp = self.storage.fingerprint_stamp()
+            self._slot_by_student = self.storage.load_fingerprint_map()
+            self._student_by_slot = {key: sid for sid, key in self._slot_by_student.items()}
+            self._counts = {}
+            for sensor_id, _ in self._student_by_slot:
+                self._counts[sensor_id] = self._counts.get(sensor_id, 0) + 1
+            self._free = {}
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded or self.storage.fingerprint_stamp() != self._stamp:
+            self._load()
+
+    def _save(self):
+        """Writes the map back. Caller holds the file lock and reloaded under it."""
+        self.storage.save_fingerprint_map(self._slot_by_student)
+        self._stamp = self.storage.fingerprint_stamp()
+
+    def capacity_of(self, sensor_id):
+        return self.capacities.get(sensor_id, self.capacity)
+
+    def set_capacity(self, sensor_id, capacity):
+        with self._lock:
+            if self.capacities.get(sensor_id) == capacity:
+                return
+            self.capacities[sensor_id] = capacity
+            self._free.pop(sensor_id, None)  # Rebuilt for the new range on next use
+
+    def _free_heap(self, sensor_id):
+        heap = self._free.get(sensor_id)
+        if heap is None:
+            heap = [slot for slot in range(1, self.capacity_of(sensor_id) + 1)
+                    if (sensor_id, slot) not in self._student_by_slot]
+            heapq.heapify(heap)
+            self._free[sensor_id] = heap
+        return heap
+
+    def adopt_legacy(self, sensor_id):
+        """Moves plain-slot entries onto sensor_id (the reader they were enrolled on)."""
+        with self._file_lock, self._lock:
+            self._ensure_loaded()
+            legacy = [sid for sid, (sensor, _) in self._slot_by_student.items() if sensor is None]
+            if not legacy:
+                return
+            for sid in legacy:
+                slot = self._slot_by_student[sid][1]
+                del self._student_by_slot[(None, slot)]
+                self._slot_by_student[sid] = (sensor_id, slot)
+                self._student_by_slot[(sensor_id, slot)] = sid
+            self._counts[sensor_id] = self._counts.get(sensor_id, 0) + self._counts.pop(None, 0)
+            self._free.pop(sensor_id, None)
+            self._save()
+            app.logger.info(f"Assigned {len(legacy)} existing fingerprint mappings to reader {sensor_id}")
+
+    def slot_of(self, student_id):
+        """(sensor_id, slot) for a student, or None."""
+        with self._lock:
+            self._ensure_loaded()
+            return self._slot_by_student.get(str(student_id))
+
+    def student_at(self, sensor_id, slot):
+        with self._lock:
+            self._ensure_loaded()
+            return self._student_by_slot.get((sensor_id, slot))
+
+    def count(self, sensor_id):
+        with self._lock:
+            self._ensure_loaded()
+            return self._counts.get(sensor_id, 0)
+
+    def next_free_slot(self, sensor_id):
+        """Lowest unused slot on a sensor, or None if it is full."""
+        with self._lock:
+            self._ensure_loaded()
+            heap = self._free_heap(sensor_id)
+            while heap and (sensor_id, heap[0]) in self._student_by_slot:
+                heapq.heappop(heap)
+            return heap[0] if heap else None
+
+    def allocate(self, sensor_ids):
+        """
+        Picks the least-loaded of sensor_ids that still has room and its lowest
+        free slot. Returns (sensor_id, slot), or None if all of them are full.
+        """
+        with self._lock:
+            candidates = sorted(sensor_ids, key=lambda s: self.count(s) / max(self.capacity_of(s), 1))
+            for sensor_id in candidates:
+                slot = self.next_free_slot(sensor_id)
+                if slot is not None:
+                    return sensor_id, slot
+            return None
+
+    def assign(self, student_id, sensor_id, slot):
+        with self._file_lock, self._lock:
+            self._ensure_loaded()
+            student_id = str(student_id)
+            key = (sensor_id, slot)
+            previous = self._slot_by_student.get(student_id)
+            if previous is not None and previous != key:
+                self._release_slot(previous)
+            # Enrolling into a slot overwrites whatever template the sensor held there
+            owner = self._student_by_slot.get(key)
+            if owner is not None and owner != student_id:
+                self._slot_by_student.pop(owner, None)
+            elif owner is None:
+                self._counts[sensor_id] = self._counts.get(sensor_id, 0) + 1
+            self._slot_by_student[student_id] = key
+            self._student_by_slot[key] = student_id
+            self._save()
+
+    def release(self, student_id):
+        """Forgets a student's slot; returns (sensor_id, slot), or None if they had none."""
+        with self._file_lock, self._lock:
+            self._ensure_loaded()
+            key = self._slot_by_student.pop(str(student_id), None)
+            if key is None:
+                return None
+            self._release_slot(key)
+            self._save()
+            return key
+
+    def _release_slot(self, key):
+        if self._student_by_slot.pop(key, None) is None:
+            return
+        sensor_id, slot = key
+        self._counts[sensor_id] -= 1
+        if sensor_id in self._free and isinstance(slot, int) and 1 <= slot <= self.capacity_of(sensor_id):
+            heapq.heappush(self._free[sensor_id], slot)
+
+fingerprint_slots = FingerprintSlotRegistry(storage, capacities=FINGERPRINT_SENSOR_CAPACITIES)
+
 def get_fingerprint_slot_for_student(student_id):
-    """Get the fingerprint slot number for a student"""
-    if os.path.exists(FINGERPRINT_MAP_FILE):
-        try:
-            with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                fp_map = json.load(f)
-                return fp_map.get(str(student_id))
-        except:
-            pass
-    return None
+    """Get the (sensor, slot) a student's fingerprint is enrolled in"""
+    return fingerprint_slots.slot_of(student_id)
 
-def save_fingerprint_mapping(student_id, slot_number):
+def save_fingerprint_mapping(student_id, sensor_id, slot_number):
     """Save student_id to fingerprint slot mapping"""
-    fp_map = {}
-    if os.path.exists(FINGERPRINT_MAP_FILE):
-        try:
-            with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                fp_map = json.load(f)
-        except:
-            pass
-    
-    fp_map[str(student_id)] = slot_number
-    
-    with open(FINGERPRINT_MAP_FILE, 'w') as f:
-        json.dump(fp_map, f, indent=2)
+    fingerprint_slots.assign(student_id, sensor_id, slot_number)
 
-def get_next_available_fingerprint_slot():
-    """Get the next available slot number for fingerprint enrollment"""
-    if os.path.exists(FINGERPRINT_MAP_FILE):
-        try:
-            with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                fp_map = json.load(f)
-                used_slots = list(fp_map.values())
-                for i in range(1, 201):  # R307S supports up to 200 fingerprints
-                    if i not in used_slots:
-                        return i
-        except:
-            pass
-    return 1  # First slot if no mappings exist
+def get_next_available_fingerprint_slot(sensor_ids):
+    """Get the (sensor, slot) to enroll into: the least-loaded of sensor_ids with room left"""
+    return fingerprint_slots.allocate(sensor_ids)
 
 # --- Main Flask Routes ---
 @app.route('/register', methods=['GET', 'POST'])
@@ -423,14 +1918,14 @@ def register():
         username = request.form['username']
         password = request.form['password']
         role = request.form['role']
-        users = load_users()
-        # Prevent duplicate usernames
-        if any(u['username'] == username for u in users):
-            flash('Username already exists.', 'danger')
-            return render_template('register.html')
-        users.append({'username': username, 'password': password, 'role': role})
-        with open('users.json', 'w') as f:
-            json.dump(users, f, indent=2)
+        with storage.lock('users'):
+            users = load_users()
+            # Prevent duplicate usernames
+            if any(u['username'] == username for u in users):
+                flash('Username already exists.', 'danger')
+                return render_template('register.html')
+            users.append({'username': username, 'password': password, 'role': role})
+            save_users(users)
         flash('Registration successful! You can now log in.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -457,34 +1952,26 @@ def logout():
     return redirect(url_for('login'))
 @app.route('/')
 def index():
-    df = get_df()  # Always reload latest CSV
-    df = _update_attendance_percentages(df)
-    save_df(df)
-    total_days = int(df['total_days'].max()) if not df.empty and 'total_days' in df.columns else 0
     if 'username' not in session:
         return redirect(url_for('login'))
-    df = get_df()
-    df = _update_attendance_percentages(df)
-    save_df(df)
-    total_days = int(df['total_days'].max()) if not df.empty and 'total_days' in df.columns else 0
     today_str = datetime.date.today().strftime("%Y-%m-%d")
-    attendance_file = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today_str}.csv")
-    present_ids = set()
-    # Automatically create today's attendance file if not exists
-    if not os.path.exists(attendance_file):
-        pd.DataFrame(columns=['Student ID', 'Name', 'Time']).to_csv(attendance_file, index=False)
-    # Update total_days for all students based on number of attendance files
-    import glob
-    attendance_files = glob.glob(os.path.join(ATTENDANCE_FOLDER, 'attendance_*.csv'))
-    total_days_count = len(attendance_files)
-    if not df.empty:
-        df['total_days'] = total_days_count
-        save_df(df)
-    try:
-        att_df = pd.read_csv(attendance_file, dtype={'Student ID': str})
-        present_ids = set(att_df['Student ID'].str.strip())
-    except Exception:
-        pass
+    # Automatically create today's attendance file if not exists. Opening a new
+    # day changes every student's total_days, so that is the only time the
+    # dashboard writes the roster back.
+    new_day = attendance_ledger.open_day(today_str)
+    total_days = attendance_ledger.total_days()
+    if new_day:
+        with roster_store.locked():
+            df = get_df()
+            if not df.empty:
+                df['total_days'] = total_days
+                save_df(df)
+    else:
+        df = get_df()
+        if not df.empty:
+            df['total_days'] = total_days
+            _derive_attendance_columns(df)
+    present_ids = attendance_ledger.present_ids(today_str)
     all_ids = set(df['student_id'].astype(str).str.strip())
     absent_ids = all_ids - present_ids
     students_not_attended = len(absent_ids)
@@ -536,27 +2023,7 @@ def index():
         # --- Calculate attendance streak for the student ---
         streak = 0
         if username and not df.empty:
-            import glob
-            attendance_files = sorted(glob.glob(os.path.join(ATTENDANCE_FOLDER, 'attendance_*.csv')), reverse=True)
-            today = datetime.date.today()
-            expected_date = today
-            for file_path in attendance_files:
-                try:
-                    filename = os.path.basename(file_path)
-                    date_str = filename.replace('attendance_', '').replace('.csv', '')
-                    file_date = datetime.datetime.strptime(date_str, '%Y-%m-%d').date()
-                    # Only count streak if file is for expected consecutive date
-                    if file_date != expected_date:
-                        break
-                    daily_df = pd.read_csv(file_path, dtype={'Student ID': str})
-                    attended_today = username in daily_df['Student ID'].astype(str).str.strip().values
-                    if attended_today:
-                        streak += 1
-                        expected_date -= datetime.timedelta(days=1)
-                    else:
-                        break
-                except Exception:
-                    break
+            streak = attendance_ledger.streak(username, datetime.date.today())
 
         # Only pass the logged-in student's data to the template
         return render_template('dashboard.html', 
@@ -572,132 +2039,134 @@ def index():
 # --- Data Management Routes ---
 @app.route('/upload_data', methods=['POST'], endpoint='upload_data')
 def upload_data():
-    if 'file' not in request.files:
-        flash('No file part', 'error')
-        return redirect(url_for('index'))
-    file = request.files['file']
-    if file.filename == '':
-        flash('No selected file', 'error')
-        return redirect(url_for('index'))
-    try:
-        existing_df = get_df()
-        new_data_df = pd.read_csv(file, dtype={'student_id': str})
+    with roster_store.locked():
+        if 'file' not in request.files:
+            flash('No file part', 'error')
+            return redirect(url_for('index'))
+        file = request.files['file']
+        if file.filename == '':
+            flash('No selected file', 'error')
+            return redirect(url_for('index'))
+        try:
+            existing_df = get_df()
+            new_data_df = pd.read_csv(file, dtype={'student_id': str})
         
-        if not existing_df.empty:
-            existing_df['student_id'] = existing_df['student_id'].str.strip()
-            new_data_df['student_id'] = new_data_df['student_id'].str.strip()
-            existing_df.set_index('student_id', inplace=True)
-            new_data_df.set_index('student_id', inplace=True)
-            existing_df.update(new_data_df)
-            new_students = new_data_df[~new_data_df.index.isin(existing_df.index)]
-            combined_df = pd.concat([existing_df, new_students])
-            combined_df.reset_index(inplace=True)
-        else:
-            combined_df = new_data_df
+            if not existing_df.empty:
+                existing_df['student_id'] = existing_df['student_id'].str.strip()
+                new_data_df['student_id'] = new_data_df['student_id'].str.strip()
+                existing_df.set_index('student_id', inplace=True)
+                new_data_df.set_index('student_id', inplace=True)
+                existing_df.update(new_data_df)
+                new_students = new_data_df[~new_data_df.index.isin(existing_df.index)]
+                combined_df = pd.concat([existing_df, new_students])
+                combined_df.reset_index(inplace=True)
+            else:
+                combined_df = new_data_df
 
-        save_df(combined_df)
-        flash('File successfully uploaded and data merged.', 'success')
-    except Exception as e:
-        flash(f'An error occurred while processing the file: {e}', 'error')
-    return redirect(url_for('index'))
+            save_df(combined_df)
+            flash('File successfully uploaded and data merged.', 'success')
+        except Exception as e:
+            flash(f'An error occurred while processing the file: {e}', 'error')
+        return redirect(url_for('index'))
 
 @app.route('/add_student', methods=['POST'])
 def add_student():
-    df = get_df()
-    student_id = request.form['student_id'].strip()
-    name = request.form['name'].strip()
-    if not student_id or not name:
-        flash('Student ID and Name cannot be empty!', 'error')
-        return redirect(url_for('index'))
-    if not df.empty and student_id in df['student_id'].values:
-        flash(f'Student ID {student_id} already exists!', 'error')
+    with roster_store.locked():
+        df = get_df()
+        student_id = request.form['student_id'].strip()
+        name = request.form['name'].strip()
+        if not student_id or not name:
+            flash('Student ID and Name cannot be empty!', 'error')
+            return redirect(url_for('index'))
+        if not df.empty and student_id in df['student_id'].values:
+            flash(f'Student ID {student_id} already exists!', 'error')
+            return redirect(url_for('index'))
+        new_student = {
+            'student_id': student_id,
+            'name': name,
+            'days_present': normalize_days_present(request.form.get('days_present', 0)),
+            'total_days': 0,
+            'attendance_percentage': 0.0,
+            'test_score_1': int(request.form.get('test_score_1', 0)),
+            'test_score_2': int(request.form.get('test_score_2', 0)),
+            'assignment_score': int(request.form.get('assignment_score', 0)),
+            'final_exam_score': np.nan,
+            'performance_category': 'N/A',
+            'parent_phone': normalize_phone(request.form.get('parent_phone', ''))
+        }
+        df = pd.concat([df, pd.DataFrame([new_student])], ignore_index=True)
+        save_df(df)
+        flash(f'Student {name} added successfully.', 'success')
         return redirect(url_for('index'))
-    new_student = {
-        'student_id': student_id,
-        'name': name,
-        'days_present': normalize_days_present(request.form.get('days_present', 0)),
-        'total_days': 0,
-        'attendance_percentage': 0.0,
-        'test_score_1': int(request.form.get('test_score_1', 0)),
-        'test_score_2': int(request.form.get('test_score_2', 0)),
-        'assignment_score': int(request.form.get('assignment_score', 0)),
-        'final_exam_score': np.nan,
-        'performance_category': 'N/A',
-        'parent_phone': normalize_phone(request.form.get('parent_phone', ''))
-    }
-    df = pd.concat([df, pd.DataFrame([new_student])], ignore_index=True)
-    save_df(df)
-    flash(f'Student {name} added successfully.', 'success')
-    return redirect(url_for('index'))
 
 @app.route('/edit_student/<string:student_id>', methods=['POST'])
 def edit_student(student_id):
-    df = get_df()
-    student_index = df.index[df['student_id'] == student_id].tolist()
-    if not student_index:
-        flash(f'Student ID {student_id} not found.', 'error')
+    with roster_store.locked():
+        df = get_df()
+        student_index = df.index[df['student_id'] == student_id].tolist()
+        if not student_index:
+            flash(f'Student ID {student_id} not found.', 'error')
+            return redirect(url_for('index'))
+        idx = student_index[0]
+        df.loc[idx, 'name'] = request.form.get('name', df.loc[idx, 'name'])
+        df.loc[idx, 'test_score_1'] = int(request.form.get('test_score_1', df.loc[idx, 'test_score_1']))
+        df.loc[idx, 'test_score_2'] = int(request.form.get('test_score_2', df.loc[idx, 'test_score_2']))
+        df.loc[idx, 'assignment_score'] = int(request.form.get('assignment_score', df.loc[idx, 'assignment_score']))
+        # Attendance fields
+        days_present = int(request.form.get('days_present', df.loc[idx, 'days_present'] if 'days_present' in df.columns else 0))
+        total_days = int(request.form.get('total_days', df.loc[idx, 'total_days'] if 'total_days' in df.columns else 0))
+        attendance_percentage = round((days_present / total_days) * 100, 2) if total_days > 0 else 0.0
+        df.loc[idx, 'days_present'] = days_present
+        df.loc[idx, 'total_days'] = total_days
+        df.loc[idx, 'attendance_percentage'] = attendance_percentage
+        # Update parent phone
+        if 'parent_phone' in df.columns:
+            df.loc[idx, 'parent_phone'] = normalize_phone(request.form.get('parent_phone', df.loc[idx, 'parent_phone']))
+        save_df(df)
+        # Force reload from disk and redirect
         return redirect(url_for('index'))
-    idx = student_index[0]
-    df.loc[idx, 'name'] = request.form.get('name', df.loc[idx, 'name'])
-    df.loc[idx, 'test_score_1'] = int(request.form.get('test_score_1', df.loc[idx, 'test_score_1']))
-    df.loc[idx, 'test_score_2'] = int(request.form.get('test_score_2', df.loc[idx, 'test_score_2']))
-    df.loc[idx, 'assignment_score'] = int(request.form.get('assignment_score', df.loc[idx, 'assignment_score']))
-    # Attendance fields
-    days_present = int(request.form.get('days_present', df.loc[idx, 'days_present'] if 'days_present' in df.columns else 0))
-    total_days = int(request.form.get('total_days', df.loc[idx, 'total_days'] if 'total_days' in df.columns else 0))
-    attendance_percentage = round((days_present / total_days) * 100, 2) if total_days > 0 else 0.0
-    df.loc[idx, 'days_present'] = days_present
-    df.loc[idx, 'total_days'] = total_days
-    df.loc[idx, 'attendance_percentage'] = attendance_percentage
-    # Update parent phone
-    if 'parent_phone' in df.columns:
-        df.loc[idx, 'parent_phone'] = normalize_phone(request.form.get('parent_phone', df.loc[idx, 'parent_phone']))
-    save_df(df)
-    # Force reload from disk and redirect
-    return redirect(url_for('index'))
 
 @app.route('/edit_attendance/<string:student_id>', methods=['POST'])
 def edit_attendance(student_id):
-    df = get_df()
-    student_index = df.index[df['student_id'] == student_id].tolist()
-    if not student_index:
-        flash(f'Student ID {student_id} not found.', 'error')
+    with roster_store.locked():
+        df = get_df()
+        student_index = df.index[df['student_id'] == student_id].tolist()
+        if not student_index:
+            flash(f'Student ID {student_id} not found.', 'error')
+            return redirect(url_for('index'))
+        idx = student_index[0]
+        # Get new days_present and total_days from form
+        days_present = int(request.form.get('days_present', df.loc[idx, 'days_present'] if 'days_present' in df.columns else 0))
+        total_days = int(request.form.get('total_days', df.loc[idx, 'total_days'] if 'total_days' in df.columns else 0))
+        # Update values
+        df.loc[idx, 'days_present'] = days_present
+        df.loc[idx, 'total_days'] = total_days
+        # Calculate percentage
+        attendance_percentage = round((days_present / total_days) * 100, 2) if total_days > 0 else 0.0
+        df.loc[idx, 'attendance_percentage'] = attendance_percentage
+        save_df(df)
+        flash(f"Attendance for {df.loc[idx, 'name']} updated: {days_present}/{total_days} days ({attendance_percentage}%)", 'success')
         return redirect(url_for('index'))
-    idx = student_index[0]
-    # Get new days_present and total_days from form
-    days_present = int(request.form.get('days_present', df.loc[idx, 'days_present'] if 'days_present' in df.columns else 0))
-    total_days = int(request.form.get('total_days', df.loc[idx, 'total_days'] if 'total_days' in df.columns else 0))
-    # Update values
-    df.loc[idx, 'days_present'] = days_present
-    df.loc[idx, 'total_days'] = total_days
-    # Calculate percentage
-    attendance_percentage = round((days_present / total_days) * 100, 2) if total_days > 0 else 0.0
-    df.loc[idx, 'attendance_percentage'] = attendance_percentage
-    save_df(df)
-    flash(f"Attendance for {df.loc[idx, 'name']} updated: {days_present}/{total_days} days ({attendance_percentage}%)", 'success')
-    return redirect(url_for('index'))
 
 @app.route('/delete_student/<string:student_id>', methods=['POST'])
 def delete_student(student_id):
-    # --- Step 5: Remove student from users.json ---
+    # --- Step 5: Remove student's login ---
     try:
-        users_json_path = os.path.join(os.path.dirname(__file__), 'users.json')
-        with open(users_json_path, 'r') as f:
-            users = json.load(f)
-        users = [user for user in users if user.get('username') != student_id]
-        with open(users_json_path, 'w') as f:
-            json.dump(users, f, indent=2)
-        app.logger.info(f"Removed student {student_id} from users.json.")
+        with storage.lock('users'):
+            users = [user for user in load_users() if user.get('username') != student_id]
+            save_users(users)
+        app.logger.info(f"Removed student {student_id} from users.")
     except Exception as e:
-        app.logger.warning(f"Could not remove student from users.json: {e}")
+        app.logger.warning(f"Could not remove student from users: {e}")
     # --- Step 1: Remove student from the main database ---
-    df = get_df()
-    if not df.empty:
-        # Reset attendance before removing
-        if student_id in df['student_id'].values:
-            df.loc[df['student_id'] == student_id, 'attendance_percentage'] = 0.0
-        df = df[df['student_id'] != student_id]
-        save_df(df)
+    with roster_store.locked():
+        df = get_df()
+        if not df.empty:
+            # Reset attendance before removing
+            if student_id in df['student_id'].values:
+                df.loc[df['student_id'] == student_id, 'attendance_percentage'] = 0.0
+            df = df[df['student_id'] != student_id]
+            save_df(df)
     
     # --- Step 2: Remove student's face images ---
     face_files = glob.glob(os.path.join(FACES_FOLDER, f'{student_id}.*.jpg'))
@@ -706,50 +2175,38 @@ def delete_student(student_id):
             os.remove(f)
         except OSError as e:
             app.logger.error(f"Error removing face image {f}: {e}")
+    try:
+        face_samples.tombstone(student_id)
+    except Exception as e:
+        app.logger.error(f"Error removing face samples for student {student_id}: {e}")
 
 
     # --- Step 3 (UPDATED): Remove student from ALL attendance logs ---
     try:
-        for filename in os.listdir(ATTENDANCE_FOLDER):
-            if filename.endswith('.csv'):
-                attendance_file_path = os.path.join(ATTENDANCE_FOLDER, filename)
-                try:
-                    att_df = pd.read_csv(attendance_file_path, dtype={'Student ID': str})
-                    if not att_df.empty and student_id in att_df['Student ID'].values:
-                        att_df_updated = att_df[att_df['Student ID'] != student_id]
-                        att_df_updated.to_csv(attendance_file_path, index=False)
-                        app.logger.info(f"Removed student {student_id} from attendance log: {filename}")
-                except (pd.errors.EmptyDataError, FileNotFoundError) as e:
-                    app.logger.warning(f"Could not modify attendance file {filename} during deletion: {e}")
+        attendance_ledger.remove_student(student_id)
     except Exception as e:
         app.logger.error(f"Error removing student {student_id} from attendance logs: {e}")
 
     # --- Step 4 (NEW): Remove student's fingerprint data ---
-    slot = get_fingerprint_slot_for_student(student_id)
-    if slot:
-        print(f"🗑️  Removing fingerprint data for student {student_id} from slot {slot}")
+    enrolled_slot = get_fingerprint_slot_for_student(student_id)
+    if enrolled_slot:
+        sensor_id, slot = enrolled_slot
+        print(f"🗑️  Removing fingerprint data for student {student_id} from slot {slot} on {sensor_id}")
         
-        if fingerprint_connected:
-            # Send delete command to ESP32 sensor
-            send_fingerprint_command(f"DELETE:{slot}")
-            response = read_fingerprint_response(timeout=5)
+        if fingerprint_hub.get(sensor_id):
+            # Send delete command to the ESP32 sensor holding the template
+            response = delete_fingerprint_from_sensor(sensor_id, slot)
             if response and response.get('success'):
                 print(f"✅ Fingerprint deleted from sensor slot {slot}")
             else:
                 print(f"⚠️  Failed to delete fingerprint from sensor slot {slot}")
         
         # Always remove from mapping file
-        if os.path.exists(FINGERPRINT_MAP_FILE):
-            try:
-                with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                    fp_map = json.load(f)
-                if str(student_id) in fp_map:
-                    del fp_map[str(student_id)]
-                    with open(FINGERPRINT_MAP_FILE, 'w') as f:
-                        json.dump(fp_map, f, indent=2)
-                    print(f"✅ Fingerprint mapping removed from fingerprint_map.json")
-            except Exception as e:
-                app.logger.error(f"Error removing fingerprint mapping for student {student_id}: {e}")
+        try:
+            fingerprint_slots.release(student_id)
+            print(f"✅ Fingerprint mapping removed from {storage.name} storage")
+        except Exception as e:
+            app.logger.error(f"Error removing fingerprint mapping for student {student_id}: {e}")
 
     flash(f'Student ID {student_id} has been completely removed from the system, including all biometric data and today\'s attendance.', 'success')
     return redirect(url_for('index'))
@@ -774,7 +2231,6 @@ def live_attendance_page():
 
 @app.route('/capture_faces', methods=['POST'])
 def capture_faces():
-    df = get_df()
     data = request.get_json()
     student_id = str(data['student_id']).strip()
     name = data['name'].strip()
@@ -784,12 +2240,30 @@ def capture_faces():
     
     if not student_id or not name:
         return jsonify({'status': 'error', 'message': 'Student ID and Name cannot be empty.'})
-        df.loc[idx, 'name'] = request.form.get('name', df.loc[idx, 'name'])
-        df.loc[idx, 'test_score_1'] = int(request.form.get('test_score_1', df.loc[idx, 'test_score_1']))
-        df.loc[idx, 'test_score_2'] = int(request.form.get('test_score_2', df.loc[idx, 'test_score_2']))
-        df.loc[idx, 'assignment_score'] = int(request.form.get('assignment_score', df.loc[idx, 'assignment_score']))
     os.makedirs(FACES_FOLDER, exist_ok=True)
     # Add the student to the main CSV first
+    _add_enrolled_student(student_id, name, parent_phone)
+
+    _save_face_crops(student_id, [_decode_data_url_frame(image_data) for image_data in data['images']])
+    return jsonify({'status': 'success', 'message': f'Successfully enrolled {name}. Remember to train the model!', 'show_fingerprint': True})
+
+@app.route('/capture_faces_upload', methods=['POST'])
+def capture_faces_upload():
+    """Same as /capture_faces, but takes a multipart form (student_id, name,
+    parent_phone) with the frames as raw JPEG 'images' files."""
+    student_id = request.form.get('student_id', '').strip()
+    name = request.form.get('name', '').strip()
+    parent_phone = normalize_phone(request.form.get('parent_phone', ''))
+    if not student_id or not name:
+        return jsonify({'status': 'error', 'message': 'Student ID and Name cannot be empty.'})
+    os.makedirs(FACES_FOLDER, exist_ok=True)
+    # Add the student to the main CSV first
+    _add_enrolled_student(student_id, name, parent_phone)
+
+    _save_face_crops(student_id, [_decode_frame_bytes(f.read()) for f in request.files.getlist('images')])
+    return jsonify({'status': 'success', 'message': f'Successfully enrolled {name}. Remember to train the model!', 'show_fingerprint': True})
+
+def _add_enrolled_student(student_id, name, parent_phone):
     new_student = {
         'student_id': student_id,
         'name': name,
@@ -801,117 +2275,554 @@ def capture_faces():
         'performance_category': 'N/A',
         'parent_phone': parent_phone
     }
-    df = pd.concat([df, pd.DataFrame([new_student])], ignore_index=True)
-    save_df(df)
+    with roster_store.locked():
+        df = pd.concat([get_df(), pd.DataFrame([new_student])], ignore_index=True)
+        save_df(df)
+
+def _save_face_crops(student_id, grays):
+    """Saves the first face found in each grayscale frame, and adds the crops to the training sample store."""
+    crops, sources = [], []
+    for i, gray in enumerate(grays):
+        try:
+            if gray is None:
+                raise ValueError('invalid image data')
+            faces = face_cascade.detectMultiScale(gray, 1.3, 5)
+            if len(faces) > 0:
+                (x, y, w, h) = faces[0]
+                face_roi = cv2.resize(gray[y:y+h, x:x+w], FACE_SIZE)
+                cv2.imwrite(os.path.join(FACES_FOLDER, f"{student_id}.{i}.jpg"), face_roi)
+                crops.append(face_roi)
+                sources.append(f"{student_id}.{i}.jpg")
+        except Exception as e: app.logger.error(f"Error processing image {i} for student {student_id}: {e}")
+    try:
+        face_samples.append(student_id, crops, sources)
+    except Exception as e:
+        app.logger.error(f"Error adding face samples for student {student_id}: {e}")
+
+# --- Face Sample Store ---
+class FaceSampleStore:
+    """Pre-decoded face crops for training.
+
+    Crops are normalized to FACE_SIZE and stored back to back in a flat uint8
+    file that training reads through np.memmap, with a matching int32 label
+    file. face_samples.json holds the student_id -> label index, the student
+    and source image of every row, and the tombstoned rows. Rows are only ever
+    appended or tombstoned; compact() rewrites the files without tombstones.
+    Labels are stable, so they double as the recognizer's id map.
+
+    Appends, tombstones and compaction hold a file lock on face_samples.json,
+    and the index is reloaded when its stamp shows another worker changed it,
+    so a stale index never writes over or truncates someone else's rows.
+    """
+
+    def __init__(self, data_file, labels_file, index_file, face_size):
+        self.data_file = data_file
+        self.labels_file = labels_file
+        self.index_file = index_file
+        self.face_size = face_size
+        self._row_bytes = face_size[0] * face_size[1]
+        self._lock = threading.RLock()
+        self._file_lock = file_lock(index_file)
+        self._index = None
+        self._stamp = None
+
+    def _load(self):
+        stamp = file_stamp(self.index_file)
+        if self._index is None or stamp != self._stamp:
+            self._stamp = stamp
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r') as f:
+                    self._index = json.load(f)
+            else:
+                self._index = {'student_index': {}, 'rows': [], 'tombstones': []}
+            self._tombstones = set(self._index['tombstones'])
+        return self._index
+
+    def _save_index(self):
+        self._index['tombstones'] = sorted(self._tombstones)
+        atomic_write(self.index_file, lambda f: json.dump(self._index, f))
+        self._stamp = file_stamp(self.index_file)
+
+    def locked(self):
+        """Lock to hold while row numbers must stay put across several calls."""
+        return self._file_lock
+
+    @staticmethod
+    def _write_at(path, offset, data):
+        # Writing at the row offset (instead of appending) overwrites any
+        # bytes left behind by an append whose index update never happened.
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+
+    def normalize(self, img):
+        if img.shape[:2] != (self.face_size[1], self.face_size[0]):
+            img = cv2.resize(img, self.face_size)
+        return np.ascontiguousarray(img, dtype=np.uint8)
+
+    def append(self, student_id, crops, sources):
+        """Appends one student's crops. Earlier live rows from the same source images are tombstoned."""
+        if not crops:
+            return 0
+        with self._file_lock, self._lock:
+            index = self._load()
+            student_index = index['student_index']
+            if student_id not in student_index:
+                student_index[student_id] = max(student_index.values(), default=-1) + 1
+            label = student_index[student_id]
+            replaced = set(sources)
+            for row, (_, source) in enumerate(index['rows']):
+                if source in replaced:
+                    self._tombstones.add(row)
+            n_rows = len(index['rows'])
+            data = np.stack([self.normalize(c) for c in crops])
+            self._write_at(self.data_file, n_rows * self._row_bytes, data.tobytes())
+            self._write_at(self.labels_file, n_rows * 4, np.full(len(crops), label, dtype=np.int32).tobytes())
+            index['rows'].extend([student_id, source] for source in sources)
+            self._save_index()
+            return len(crops)
+
+    def tombstone(self, student_id):
+        """Marks every row of a student as deleted. Returns the number of rows affected."""
+        with self._file_lock, self._lock:
+            index = self._load()
+            rows = [row for row, (sid, _) in enumerate(index['rows']) if sid == student_id and row not in self._tombstones]
+            if rows:
+                self._tombstones.update(rows)
+                self._save_index()
+            return len(rows)
+
+    def tombstone_count(self):
+        with self._lock:
+            self._load()
+            return len(self._tombstones)
+
+    def live_rows(self, start=0):
+        with self._lock:
+            n_rows = len(self._load()['rows'])
+            return [row for row in range(start, n_rows) if row not in self._tombstones]
+
+    def snapshot(self, start=0):
+        """Returns (live rows from start, row count, tombstone count), all read together.
+
+        Training records these counts, not the ones after it finishes, so rows
+        appended or tombstoned while it runs are picked up by the next run.
+        """
+        with self._lock:
+            n_rows = len(self._load()['rows'])
+            return [row for row in range(start, n_rows) if row not in self._tombstones], n_rows, len(self._tombstones)
+
+    def live_sources(self):
+        with self._lock:
+            index = self._load()
+            return {source for row, (_, source) in enumerate(index['rows']) if row not in self._tombstones}
+
+    def id_map(self):
+        """student_id -> label for every student that still has live rows."""
+        with self._lock:
+            index = self._load()
+            live_students = {index['rows'][row][0] for row in self.live_rows()}
+            return {sid: label for sid, label in index['student_index'].items() if sid in live_students}
+
+    def arrays(self):
+        """Returns (images, labels) memory-mapped over every row, tombstoned or not."""
+        with self._lock:
+            n_rows = len(self._load()['rows'])
+            if n_rows == 0:
+                return np.empty((0, self.face_size[1], self.face_size[0]), np.uint8), np.empty(0, np.int32)
+            images = np.memmap(self.data_file, dtype=np.uint8, mode='r', shape=(n_rows, self.face_size[1], self.face_size[0]))
+            labels = np.memmap(self.labels_file, dtype=np.int32, mode='r', shape=(n_rows,))
+            return images, labels
+
+    def compact(self):
+        """Rewrites the store without tombstoned rows."""
+        with self._file_lock, self._lock:
+            index = self._load()
+            if not self._tombstones:
+                return
+            keep = self.live_rows()
+            images, labels = self.arrays()
+            kept_images, kept_labels = np.array(images[keep]), np.array(labels[keep])
+            del images, labels  # Release the maps before replacing the files
+            for path, data in ((self.data_file, kept_images), (self.labels_file, kept_labels)):
+                atomic_write(path, lambda f: f.write(data.tobytes()), mode='wb')
+            index['rows'] = [index['rows'][row] for row in keep]
+            self._tombstones = set()
+            self._save_index()
+
+face_samples = FaceSampleStore(FACE_SAMPLES_FILE, FACE_LABELS_FILE, FACE_SAMPLES_INDEX_FILE, FACE_SIZE)
+
+# --- Face Model Training ---
+def _face_image_student_id(image_path):
+    return os.path.basename(image_path).split('.')[0]
+
+def _load_train_state():
+    """Returns {'trained_rows', 'tombstones'} recorded by the last training run."""
+    if os.path.exists(TRAIN_STATE_FILE):
+        try:
+            with open(TRAIN_STATE_FILE, 'r') as f:
+                state = json.load(f)
+            if 'trained_rows' in state:
+                return state
+        except (OSError, ValueError):
+            pass
+    return None
+
+def _save_train_state(trained_rows, tombstones):
+    with file_lock(TRAIN_STATE_FILE):
+        atomic_write(TRAIN_STATE_FILE, lambda f: json.dump({'trained_rows': trained_rows, 'tombstones': tombstones}, f))
+
+def _decode_face_image(image_path):
+    """Reads one face crop as grayscale. Returns (image, error message)."""
+    try:
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if img is None or img.size == 0:
+            return None, 'unreadable or corrupt image'
+        return img, None
+    except Exception as e:
+        return None, str(e)
+
+def _read_face_samples(image_paths, progress=None):
+    """Decodes face images across a thread pool (cv2 releases the GIL while decoding).
+
+    Results are consumed in order as they finish. Unreadable files are logged
+    and returned in the skipped list instead of failing the batch.
+    """
+    face_images, read_paths, skipped = [], [], []
+    with ThreadPoolExecutor(max_workers=FACE_DECODE_WORKERS) as pool:
+        for i, (image_path, (img, error)) in enumerate(zip(image_paths, pool.map(_decode_face_image, image_paths))):
+            if error:
+                app.logger.error(f"Error processing {image_path}: {error}")
+                skipped.append({'file': os.path.basename(image_path), 'error': error})
+            else:
+                face_images.append(img)
+                read_paths.append(image_path)
+            if progress:
+                progress(i + 1, len(image_paths))
+    return face_images, read_paths, skipped
+
+def _import_face_folder(progress=None):
+    """Adds images in faces/ that are not in the sample store yet (e.g. from before
+    the store existed, or copied in by hand). Returns the skipped files."""
+    os.makedirs(FACES_FOLDER, exist_ok=True)
+    known = face_samples.live_sources()
+    new_files = sorted(f for f in os.listdir(FACES_FOLDER) if f not in known)
+    if not new_files:
+        return []
+    face_images, read_paths, skipped = _read_face_samples([os.path.join(FACES_FOLDER, f) for f in new_files], progress)
+    by_student = {}
+    for img, path in zip(face_images, read_paths):
+        crops, sources = by_student.setdefault(_face_image_student_id(path), ([], []))
+        crops.append(img)
+        sources.append(os.path.basename(path))
+    for student_id, (crops, sources) in by_student.items():
+        face_samples.append(student_id, crops, sources)
+    app.logger.info(f"Imported {len(read_paths)} face images into the sample store")
+    return skipped
+
+def train_face_model(mode='auto', progress=None):
+    """Trains the face model from the face sample store and returns a {'status', 'message'} result.
+
+    mode='incremental' (or 'auto' when a model exists) only feeds rows appended
+    since the last run through LBPH update(). Tombstoned rows (deleted or
+    re-enrolled students) cannot be taken out of an LBPH model, so they force a
+    full retrain, which also compacts the store; so does mode='full'.
+    """
+    skipped = _import_face_folder(progress)
+
+    state = _load_train_state()
+    full_retrain = (
+        mode == 'full'
+        or state is None
+        or face_model.get() is None
+        # Rows were tombstoned since the last run
+        or face_samples.tombstone_count() != state['tombstones']
+    )
+    # Another worker's compact() renumbers rows, so map the files under the same lock
+    with face_samples.locked():
+        if full_retrain:
+            face_samples.compact()
+            rows, trained_rows, tombstones = face_samples.snapshot()
+        else:
+            rows, trained_rows, tombstones = face_samples.snapshot(start=state['trained_rows'])
+            if not rows:
+                return {'status': 'success', 'message': 'Model is already up to date.', 'skipped': skipped}
+        if not rows:
+            if not skipped:
+                return {'status': 'error', 'message': 'No face images found to train.'}
+            return {'status': 'error', 'message': 'No valid face samples could be processed.', 'skipped': skipped}
+        images, labels = face_samples.arrays()
+
+    batch = [images[row] for row in rows]
+    batch_labels = np.asarray(labels[rows], dtype=np.int32)
+    if progress:
+        progress(len(rows), len(rows))
+
+    # Work on a separate recognizer so in-flight /recognize calls keep the old one
+    new_recognizer = cv2.face.LBPHFaceRecognizer_create()
+    if full_retrain:
+        new_recognizer.train(batch, batch_labels)
+    else:
+        new_recognizer.read(MODEL_FILE)
+        new_recognizer.update(batch, batch_labels)
+    del images, labels, batch
+    # Write beside the live model and rename, so a reader never loads a half-written file
+    tmp_model_file = MODEL_FILE + '.tmp.yml'
+    new_recognizer.write(tmp_model_file)
+    os.replace(tmp_model_file, MODEL_FILE)
+    id_map = face_samples.id_map()
+    storage.save_document('id_map', id_map)
+    _save_train_state(trained_rows, tombstones)
+    face_model.install(new_recognizer, id_map)
+
+    if full_retrain:
+        message = f'Model trained with {len(rows)} images from {len(set(batch_labels.tolist()))} students.'
+    else:
+        message = f'Model updated with {len(rows)} new images ({len(id_map)} students total).'
+    if skipped:
+        message += f' Skipped {len(skipped)} unreadable images.'
+    return {'status': 'success', 'message': message, 'skipped': skipped}
+
+# --- Background Training Jobs ---
+training_jobs = {}  # job_id -> job status dict, most recent last
+training_jobs_lock = threading.Lock()
+training_run_lock = threading.Lock()  # Only one training run touches trainer.yml at a time
+MAX_TRAINING_JOBS_KEPT = 20
+
+def submit_training_job(mode='auto'):
+    """Queues a training run on the background scheduler.
+
+    Requests that arrive while a run is still queued are coalesced into it. If
+    a run is already in progress, one follow-up run is queued so images
+    captured in the meantime are not missed.
+    """
+    with training_jobs_lock:
+        for job in training_jobs.values():
+            if job['state'] == 'queued':
+                if mode == 'full':
+                    job['mode'] = 'full'
+                return dict(job)
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'mode': mode,
+            'state': 'queued',
+            'loaded': 0,
+            'total': 0,
+            'message': 'Training queued',
+            'submitted_at': datetime.datetime.now().strftime("%H:%M:%S"),
+            'finished_at': None,
+            'skipped': [],
+        }
+        training_jobs[job['job_id']] = job
+        # Forget the oldest finished jobs
+        finished = [jid for jid, j in training_jobs.items() if j['state'] in ('completed', 'failed')]
+        for jid in finished[:max(0, len(training_jobs) - MAX_TRAINING_JOBS_KEPT)]:
+            del training_jobs[jid]
+        job_copy = dict(job)
 
-    # Save face images
-    for i, image_data in enumerate(data['images']):
+    if not scheduler.running:
+        scheduler.start()
+    scheduler.add_job(
+        func=_run_training_job,
+        args=[job_copy['job_id']],
+        id=f"train_model_{job_copy['job_id']}",
+        name='Train face model',
+        misfire_grace_time=None  # Run however late it starts; a missed job would stay 'queued' forever
+    )
+    return job_copy
+
+def _run_training_job(job_id):
+    job = training_jobs[job_id]
+
+    def report_progress(loaded, total):
+        job['loaded'], job['total'] = loaded, total
+
+    with training_run_lock:
+        with training_jobs_lock:
+            job['state'] = 'running'
+            job['message'] = 'Loading face images...'
         try:
-            _, encoded = image_data.split(",", 1)
-            nparr = np.frombuffer(base64.b64decode(encoded), np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.3, 5)
-            if len(faces) > 0:
-                (x, y, w, h) = faces[0]
-                face_roi = cv2.resize(gray[y:y+h, x:x+w], (200, 200))
-                cv2.imwrite(os.path.join(FACES_FOLDER, f"{student_id}.{i}.jpg"), face_roi)
-        except Exception as e: app.logger.error(f"Error processing image {i} for student {student_id}: {e}")
-    
-    return jsonify({'status': 'success', 'message': f'Successfully enrolled {name}. Remember to train the model!', 'show_fingerprint': True})
+            result = train_face_model(job['mode'], progress=report_progress)
+            job['state'] = 'completed' if result['status'] == 'success' else 'failed'
+            job['message'] = result['message']
+            job['skipped'] = result.get('skipped', [])
+        except Exception as e:
+            app.logger.error(f"Training job {job_id} failed: {e}")
+            job['state'] = 'failed'
+            job['message'] = f'Training failed: {e}'
+        job['finished_at'] = datetime.datetime.now().strftime("%H:%M:%S")
 
 @app.route('/train_model', methods=['POST'])
 def train_model_route():
-    image_paths = [os.path.join(FACES_FOLDER, f) for f in os.listdir(FACES_FOLDER)]
-    if not image_paths:
-        return jsonify({'status': 'error', 'message': 'No face images found to train.'})
-    
-    face_samples, labels = [], []
-    # Create a mapping from alphanumeric student_id to an integer label
-    student_ids = sorted(list(set([os.path.basename(p).split('.')[0] for p in image_paths])))
-    id_map = {sid: i for i, sid in enumerate(student_ids)}
-    
-    with open(ID_MAP_FILE, 'w') as f:
-        json.dump(id_map, f)
+    data = request.get_json(silent=True) or {}
+    mode = request.args.get('mode', data.get('mode', 'auto'))
+    job = submit_training_job(mode)
+    return jsonify({'status': 'queued', 'job_id': job['job_id'], 'message': 'Training started in the background.'}), 202
+
+@app.route('/train_model/status/<string:job_id>')
+def training_job_status(job_id):
+    """Progress of a background training job (images loaded / total and state)."""
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Unknown training job'}), 404
+    return jsonify(dict(job))
+
+# --- Face Recognition ---
+RECOGNITION_CONFIDENCE_THRESHOLD = 80
+MAX_FRAMES_PER_BATCH = 32
+frame_decode_pool = ThreadPoolExecutor(max_workers=FACE_DECODE_WORKERS)
+
+def _decode_frame_bytes(buf):
+    """Decodes encoded image bytes (JPEG/PNG) into a grayscale frame, or None if it is not an image."""
+    nparr = np.frombuffer(buf, np.uint8)  # A view over buf, no copy
+    if nparr.size == 0:
+        return None
+    try:
+        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    except cv2.error:
+        return None
+    if frame is None:
+        return None
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-    for image_path in image_paths:
-        try:
-            img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-            student_id_str = os.path.basename(image_path).split('.')[0]
-            label = id_map[student_id_str]
-            face_samples.append(img)
-            labels.append(label)
-        except Exception as e:
-            app.logger.error(f"Error processing {image_path}: {e}")
+def _decode_data_url_frame(image_data):
+    """Decodes a base64 data URL into a grayscale frame, or None if it is not an image."""
+    try:
+        buf = base64.b64decode(image_data.split(',')[1])
+    except Exception:
+        return None
+    return _decode_frame_bytes(buf)
 
-    if not labels:
-        return jsonify({'status': 'error', 'message': 'No valid face samples could be processed.'})
-        
-    recognizer.train(face_samples, np.array(labels))
-    recognizer.write(MODEL_FILE)
-    return jsonify({'status': 'success', 'message': f'Model trained with {len(face_samples)} images from {len(id_map)} students.'})
+def _recognize_faces(gray, recognizer, rev_id_map, student_info, can_mark):
+    """Detects and identifies faces in one grayscale frame.
 
-@app.route('/recognize', methods=['POST'])
-def recognize():
-    if not os.path.exists(MODEL_FILE) or not os.path.exists(ID_MAP_FILE):
-        return jsonify({'error': 'Model or ID map not found'}), 500
+    Attendance is marked for recognized students that can_mark(student_id)
+    allows; everyone else is reported as Unknown.
+    """
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+    recognized_faces = []
+
+    for (x, y, w, h) in faces:
+        label_pred, conf = recognizer.predict(gray[y:y+h, x:x+w])
+        name = "Unknown"
+        attendance = {'percentage': 0.0, 'status': ''}
+        status = ''
+        student_id = rev_id_map.get(label_pred)
+        if conf < RECOGNITION_CONFIDENCE_THRESHOLD and can_mark(student_id):
+            if student_id and student_id in student_info:
+                name = student_info[student_id]
+                attendance = mark_attendance(student_id, name)
+                status = attendance.get('status', '')
+            recognized_faces.append({
+                'name': name,
+                'student_id': student_id,
+                'box': [int(x), int(y), int(w), int(h)],
+                'attendance': float(attendance.get('percentage', 0.0)),
+                'confidence': float(conf),
+                'status': status
+            })
+        else:
+            # Not someone this session may mark, show as unknown
+            recognized_faces.append({
+                'name': "Unknown",
+                'student_id': None,
+                'box': [int(x), int(y), int(w), int(h)],
+                'attendance': 0.0,
+                'confidence': float(conf),
+                'status': ''
+            })
+    return recognized_faces
+
+def _load_face_model_or_error():
+    """Returns ((recognizer, rev_id_map), None) or (None, error response)."""
     try:
-        recognizer.read(MODEL_FILE)
-        with open(ID_MAP_FILE, 'r') as f: id_map = json.load(f)
-        rev_id_map = {v: k for k, v in id_map.items()}
+        loaded_model = face_model.get()
     except Exception as e:
-        return jsonify({'error': 'Failed to load recognition model or ID map'}), 500
+        return None, (jsonify({'error': 'Failed to load recognition model or ID map'}), 500)
+    if loaded_model is None:
+        return None, (jsonify({'error': 'Model or ID map not found'}), 500)
+    return loaded_model, None
+
+def _recognize_session_frame(decode_frame):
+    """Shared body of /recognize and /recognize_frame; decode_frame() returns the grayscale frame."""
+    loaded_model, error = _load_face_model_or_error()
+    if error:
+        return error
+    recognizer, rev_id_map = loaded_model
 
-    df = get_df()
-    student_info = {row['student_id']: row['name'] for _, row in df.iterrows()}
+    student_info = roster_store.names()
     # Only allow marking for the logged-in student
     session_student_id = session.get('username')
 
     try:
-        image_data = request.json['image'].split(',')[1]
-        nparr = np.frombuffer(base64.b64decode(image_data), np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is None: return jsonify({'error': 'Invalid image data'}), 400
-        
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
-        recognized_faces = []
-
-        for (x, y, w, h) in faces:
-            label_pred, conf = recognizer.predict(gray[y:y+h, x:x+w])
-            name = "Unknown"
-            attendance = {'percentage': 0.0, 'status': ''}
-            status = ''
-            # Using a confidence threshold of 80
-            student_id = rev_id_map.get(label_pred)
-            if conf < 80 and student_id == session_student_id:
-                if student_id and student_id in student_info:
-                    name = student_info[student_id]
-                    attendance = mark_attendance(student_id, name)
-                    status = attendance.get('status', '')
-                recognized_faces.append({
-                    'name': name,
-                    'student_id': student_id,
-                    'box': [int(x), int(y), int(w), int(h)],
-                    'attendance': float(attendance.get('percentage', 0.0)),
-                    'confidence': float(conf),
-                    'status': status
-                })
-            else:
-                # If not the logged-in student, ignore or show as unknown
-                recognized_faces.append({
-                    'name': "Unknown",
-                    'student_id': None,
-                    'box': [int(x), int(y), int(w), int(h)],
-                    'attendance': 0.0,
-                    'confidence': float(conf),
-                    'status': ''
-                })
+        gray = decode_frame()
+        if gray is None: return jsonify({'error': 'Invalid image data'}), 400
+        recognized_faces = _recognize_faces(gray, recognizer, rev_id_map, student_info,
+                                            lambda student_id: student_id == session_student_id)
         return jsonify({'recognized_faces': recognized_faces})
     except Exception as e:
         app.logger.error(f"Error in recognition: {str(e)}")
         return jsonify({'error': f'Recognition failed: {str(e)}'}), 500
 
+@app.route('/recognize', methods=['POST'])
+def recognize():
+    return _recognize_session_frame(lambda: _decode_data_url_frame(request.json['image']))
+
+@app.route('/recognize_frame', methods=['POST'])
+def recognize_frame():
+    """Same as /recognize, but the frame is sent as raw JPEG bytes: either the
+    request body (image/jpeg or application/octet-stream) or a multipart
+    'frame' file. Skips the base64 and JSON overhead of data URLs."""
+    def decode_frame():
+        if 'frame' in request.files:
+            return _decode_frame_bytes(request.files['frame'].read())
+        return _decode_frame_bytes(request.get_data(cache=False))
+    return _recognize_session_frame(decode_frame)
+
+@app.route('/recognize_batch', methods=['POST'])
+def recognize_batch():
+    """Recognizes faces in several frames (e.g. from several classroom cameras) in one call.
+
+    Expects {'frames': [{'camera': 'room-101', 'image': '<data URL>'}, ...]}.
+    Frames are decoded in parallel, and the model, id map and roster are
+    loaded once for the whole batch. Teachers may mark any recognized student,
+    students only themselves (as on /recognize).
+    """
+    loaded_model, error = _load_face_model_or_error()
+    if error:
+        return error
+    recognizer, rev_id_map = loaded_model
+
+    frames = (request.get_json(silent=True) or {}).get('frames') or []
+    if not frames:
+        return jsonify({'error': 'No frames provided'}), 400
+    if len(frames) > MAX_FRAMES_PER_BATCH:
+        return jsonify({'error': f'At most {MAX_FRAMES_PER_BATCH} frames per batch'}), 413
+    frames = [f if isinstance(f, dict) else {'image': f} for f in frames]
+
+    student_info = roster_store.names()
+    session_student_id = session.get('username')
+    if session.get('role') == 'teacher':
+        can_mark = lambda student_id: student_id is not None
+    else:
+        can_mark = lambda student_id: student_id == session_student_id
+
+    try:
+        grays = frame_decode_pool.map(_decode_data_url_frame, [f.get('image', '') for f in frames])
+        results = []
+        for i, (frame_info, gray) in enumerate(zip(frames, grays)):
+            result = {'frame': i, 'camera': frame_info.get('camera')}
+            if gray is None:
+                result['error'] = 'Invalid image data'
+            else:
+                result['recognized_faces'] = _recognize_faces(gray, recognizer, rev_id_map, student_info, can_mark)
+            results.append(result)
+        return jsonify({'results': results})
+    except Exception as e:
+        app.logger.error(f"Error in batch recognition: {str(e)}")
+        return jsonify({'error': f'Recognition failed: {str(e)}'}), 500
+
 # --- Barcode and Attendance Routes ---
 @app.route('/barcode_attendance')
 def barcode_attendance_page():
@@ -929,15 +2840,13 @@ def mark_barcode_attendance():
     try:
         data = request.get_json()
         scanned_id = str(data['student_id']).strip()
-        df = get_df()
-        if df.empty:
+        if not roster_store.ids():
             return jsonify({'success': False, 'message': 'Student database is empty.'}), 404
-        student_row = df[df['student_id'] == scanned_id]
-        if student_row.empty:
+        student_name = roster_store.name_of(scanned_id)
+        if student_name is None:
             return jsonify({'success': False, 'message': f"Student ID '{scanned_id}' not found."}), 404
         # Store pending attendance in session
         session['pending_attendance'] = scanned_id
-        student_name = student_row.iloc[0]['name']
         return jsonify({
             'success': True,
             'student': {'id': scanned_id, 'name': student_name},
@@ -954,12 +2863,10 @@ def verify_fingerprint_attendance():
         pending_id = session.get('pending_attendance')
         if not pending_id:
             return jsonify({'success': False, 'message': 'No pending barcode scan.'}), 400
-        df = get_df()
-        student_row = df[df['student_id'] == pending_id]
-        if student_row.empty:
+        student_name = roster_store.name_of(pending_id)
+        if student_name is None:
             session.pop('pending_attendance', None)
             return jsonify({'success': False, 'message': 'Student not found.'}), 404
-        student_name = student_row.iloc[0]['name']
         # Here, add fingerprint verification logic (pseudo):
         # if not verify_fingerprint(pending_id):
         #     return jsonify({'success': False, 'message': 'Fingerprint verification failed.'}), 403
@@ -994,74 +2901,92 @@ def fingerprint_attendance_page():
     df = get_df()
     if role == 'student':
         df = df[df['student_id'] == username]
-        return render_template('fingerprint_attendance.html', students=df.to_dict(orient='records'), fingerprint_connected=fingerprint_connected)
-    return render_template('fingerprint_attendance.html', students=None, fingerprint_connected=fingerprint_connected)
+        return render_template('fingerprint_attendance.html', students=df.to_dict(orient='records'), fingerprint_connected=fingerprint_hub.connected)
+    return render_template('fingerprint_attendance.html', students=None, fingerprint_connected=fingerprint_hub.connected)
 
 @app.route('/fingerprint_status')
 def fingerprint_status():
-    """Check if fingerprint reader is connected"""
-    return jsonify({'connected': fingerprint_connected})
+    """Check if any fingerprint reader is connected, with the health of each"""
+    return jsonify({'connected': fingerprint_hub.connected, 'sensors': fingerprint_hub.status()})
+
+# --- Fingerprint Enrollment Operations ---
+ENROLLMENT_TIMEOUT = 60  # Seconds the student has to complete the finger placements
+MAX_ENROLLMENT_EVENTS = 50  # Per-operation log; older events fall off and the client sees 'truncated'
+MAX_ENROLLMENT_OPS_KEPT = 20
+enrollment_ops = {}  # op_id -> EnrollmentOperation, most recent last
+enrollment_ops_lock = threading.Lock()
+
+class EnrollmentOperation:
+    """One fingerprint enrollment running in the background, with a bounded, numbered event log."""
+
+    def __init__(self, student_id, sensor_id, slot):
+        self.op_id = uuid.uuid4().hex
+        self.student_id = student_id
+        self.sensor_id = sensor_id
+        self.slot = slot
+        self.state = 'running'  # running -> completed | failed | timeout
+        self.message = f'Starting enrollment in slot {slot}...'
+        self.submitted_at = datetime.datetime.now().strftime("%H:%M:%S")
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=MAX_ENROLLMENT_EVENTS)
+        self._seq = 0
+
+    def add_event(self, msg_type, message):
+        with self._lock:
+            self._seq += 1
+            self._events.append({'seq': self._seq, 'type': msg_type, 'message': message})
+
+    def finish(self, state, message):
+        with self._lock:
+            self.state = state
+            self.message = message
+            self.finished_at = datetime.datetime.now().strftime("%H:%M:%S")
+
+    def status(self, cursor=0):
+        """State plus the events after cursor; pass the returned cursor back to get only newer ones."""
+        with self._lock:
+            events = [event for event in self._events if event['seq'] > cursor]
+            truncated = bool(self._events) and self._events[0]['seq'] > cursor + 1
+            return {
+                'op_id': self.op_id,
+                'student_id': self.student_id,
+                'sensor_id': self.sensor_id,
+                'slot': self.slot,
+                'state': self.state,
+                'success': self.state == 'completed',
+                'message': self.message,
+                'submitted_at': self.submitted_at,
+                'finished_at': self.finished_at,
+                'events': events,
+                'cursor': self._seq,
+                'truncated': truncated,
+            }
 
-@app.route('/enroll_fingerprint', methods=['POST'])
-def enroll_fingerprint_route():
-    """Enroll a fingerprint for a student"""
-    global fingerprint_enrollment_status, fingerprint_enrollment_active
-    fingerprint_enrollment_status = []  # Clear previous messages
-    fingerprint_enrollment_active = True  # Set enrollment flag to prevent attendance during enrollment
-    
-    if not fingerprint_connected:
-        fingerprint_enrollment_active = False  # Reset flag on early exit
-        return jsonify({'success': False, 'message': 'Fingerprint reader not connected'}), 503
-    
-    data = request.get_json()
-    student_id = str(data.get('student_id', '')).strip()
-    
-    print("\n" + "="*60)
-    print(f"🔵 FINGERPRINT ENROLLMENT STARTED for Student ID: {student_id}")
-    print("="*60)
-    
-    df = get_df()
-    student_row = df[df['student_id'] == student_id]
-    
-    if student_row.empty:
-        print(f"❌ Student ID {student_id} not found in database")
-        return jsonify({'success': False, 'message': f'Student ID {student_id} not found'}), 404
-    
-    # Check if already enrolled
-    existing_slot = get_fingerprint_slot_for_student(student_id)
-    if existing_slot:
-        print(f"⚠️  Student already enrolled in slot {existing_slot}")
-        return jsonify({'success': False, 'message': f'Student already has fingerprint enrolled in slot {existing_slot}'}), 400
-    
-    # Get next available slot
-    slot = get_next_available_fingerprint_slot()
-    print(f"📍 Using fingerprint slot: {slot}")
-    
-    # Send enrollment command to ESP32
-    fingerprint_enrollment_status.append({'type': 'info', 'message': f'Starting enrollment in slot {slot}...'})
-    print(f"\n🔄 Sending enrollment command: ENROLL:{slot}")
-    send_fingerprint_command(f"ENROLL:{slot}")
-    
-    # Read enrollment responses
-    responses = []
-    enrollment_complete = False
-    start_time = time.time()
-    
-    print("\n📥 Listening for ESP32 responses...")
-    while time.time() - start_time < 60:  # 60 second timeout
-        # Read multiple responses if available (ESP32 sends them quickly)
-        response = read_fingerprint_response(timeout=0.2)
-        if response:
-            responses.append(response)
+def _run_enrollment(op, sensor):
+    """Drives one enrollment on a sensor; runs on its own thread so no request waits on it"""
+    # Subscribe before sending so the ESP32's first prompt can't slip past
+    waiter = sensor.engine.open_waiter(FINGERPRINT_ENROLLMENT_MESSAGES)
+    try:
+        # Wake this reader only; the page activates it by id once it knows which one was picked
+        send_fingerprint_command("ACTIVATE", sensor.sensor_id)
+        print(f"\n🔄 Sending enrollment command to {sensor.sensor_id}: ENROLL:{op.slot}")
+        send_fingerprint_command(f"ENROLL:{op.slot}", sensor.sensor_id)
+        deadline = time.monotonic() + ENROLLMENT_TIMEOUT
+
+        print("\n📥 Listening for ESP32 responses...")
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                response = waiter[1].get(timeout=remaining)
+            except queue.Empty:
+                break
             msg_type = response.get('type')
             msg_text = response.get('message', '')
-            
-            # Store ALL message types for real-time updates
-            fingerprint_enrollment_status.append({
-                'type': msg_type,
-                'message': msg_text
-            })
-            
+            op.add_event(msg_type, msg_text)
+
             # Terminal output based on type
             if msg_type == 'prompt':
                 print(f"👆 USER ACTION REQUIRED: {msg_text}")
@@ -1071,239 +2996,284 @@ def enroll_fingerprint_route():
                 print(f"💡 Info: {msg_text}")
             elif msg_type == 'enrolled':
                 if response.get('success'):
-                    save_fingerprint_mapping(student_id, slot)
-                    enrollment_complete = True
-                    fingerprint_enrollment_status.append({'type': 'success', 'message': 'Enrollment complete!'})
-                    fingerprint_enrollment_active = False  # Reset enrollment flag
-                    
-                    # Clear the fingerprint queue to remove any match messages from enrollment
-                    while not fingerprint_queue.empty():
-                        try:
-                            fingerprint_queue.get_nowait()
-                        except queue.Empty:
-                            break
-                    print("🗑️  Cleared fingerprint queue (removed enrollment matches)")
-                    
+                    save_fingerprint_mapping(op.student_id, op.sensor_id, op.slot)
+                    op.add_event('success', 'Enrollment complete!')
+                    sensor.enrolling = False  # Reset enrollment flag
+
                     # Deactivate sensor after successful enrollment
                     print("🔌 Deactivating sensor after enrollment...")
-                    send_fingerprint_command("DEACTIVATE")
-                    
+                    sensor.activated = False
+                    send_fingerprint_command("DEACTIVATE", sensor.sensor_id)
+
                     print(f"\n✅ ENROLLMENT SUCCESSFUL!")
-                    print(f"   Student: {student_id}")
-                    print(f"   Slot: {slot}")
+                    print(f"   Student: {op.student_id}")
+                    print(f"   Sensor: {op.sensor_id}")
+                    print(f"   Slot: {op.slot}")
                     print(f"   Sensor deactivated")
                     print("="*60 + "\n")
-                    return jsonify({
-                        'success': True,
-                        'message': f'Fingerprint enrolled successfully in slot {slot}',
-                        'slot': slot,
-                        'responses': responses
-                    })
+                    op.finish('completed', f'Fingerprint enrolled successfully in slot {op.slot}')
+                    return
             elif msg_type == 'error':
-                fingerprint_enrollment_status.append({'type': 'error', 'message': msg_text})
-                fingerprint_enrollment_active = False  # Reset enrollment flag on error
-                
-                # Clear the fingerprint queue
-                while not fingerprint_queue.empty():
-                    try:
-                        fingerprint_queue.get_nowait()
-                    except queue.Empty:
-                        break
-                
+                sensor.enrolling = False  # Reset enrollment flag on error
+
                 # Deactivate sensor on error
                 print("🔌 Deactivating sensor after enrollment error...")
-                send_fingerprint_command("DEACTIVATE")
-                
+                sensor.activated = False
+                send_fingerprint_command("DEACTIVATE", sensor.sensor_id)
+
                 print(f"\n❌ ENROLLMENT FAILED: {msg_text}")
                 print("="*60 + "\n")
-                return jsonify({
-                    'success': False,
-                    'message': msg_text,
-                    'responses': responses
-                }), 400
-            else:
-                # Capture any other message types
-                print(f"📨 ESP32 Message [{msg_type}]: {msg_text}")
-        
-        # Show timeout countdown every 10 seconds
-        elapsed = int(time.time() - start_time)
-        if elapsed > 0 and elapsed % 10 == 0:
-            remaining = 60 - elapsed
-            if remaining > 0 and elapsed % 10 < 1:  # Print only once per 10-second interval
-                print(f"⏳ Waiting... ({remaining} seconds remaining)")
-    
-    fingerprint_enrollment_status.append({'type': 'error', 'message': 'Enrollment timeout - please try again'})
-    fingerprint_enrollment_active = False  # Reset enrollment flag on timeout
-    
-    # Clear the fingerprint queue on timeout
-    while not fingerprint_queue.empty():
-        try:
-            fingerprint_queue.get_nowait()
-        except queue.Empty:
-            break
-    
-    # Deactivate sensor on timeout
-    print("🔌 Deactivating sensor after enrollment timeout...")
-    send_fingerprint_command("DEACTIVATE")
-    
-    print(f"\n⏱️  ENROLLMENT TIMEOUT (60 seconds elapsed)")
-    print(f"   Responses received: {len(responses)}")
-    print("="*60 + "\n")
+                op.finish('failed', msg_text)
+                return
+
+        op.add_event('error', 'Enrollment timeout - please try again')
+        sensor.enrolling = False  # Reset enrollment flag on timeout
+
+        # Deactivate sensor on timeout
+        print("🔌 Deactivating sensor after enrollment timeout...")
+        sensor.activated = False
+        send_fingerprint_command("DEACTIVATE", sensor.sensor_id)
+
+        print(f"\n⏱️  ENROLLMENT TIMEOUT ({ENROLLMENT_TIMEOUT} seconds elapsed)")
+        print("="*60 + "\n")
+        op.finish('timeout', 'Enrollment timeout - did you place your finger on the sensor?')
+    except Exception as e:
+        app.logger.error(f"Fingerprint enrollment {op.op_id} failed: {e}")
+        sensor.enrolling = False
+        op.finish('failed', f'Enrollment failed: {e}')
+    finally:
+        sensor.engine.close_waiter(waiter)
+
+@app.route('/enroll_fingerprint', methods=['POST'])
+def enroll_fingerprint_route():
+    """
+    Start enrolling a fingerprint for a student; poll /enrollment_status?op=<op_id>
+    for progress. An optional 'sensor' picks the reader the student is standing at.
+    """
+    if not fingerprint_hub.connected:
+        return jsonify({'success': False, 'message': 'Fingerprint reader not connected'}), 503
+
+    data = request.get_json()
+    student_id = str(data.get('student_id', '')).strip()
+    requested_sensor = data.get('sensor')
+
+    print("\n" + "="*60)
+    print(f"🔵 FINGERPRINT ENROLLMENT STARTED for Student ID: {student_id}")
+    print("="*60)
+
+    if not roster_store.contains(student_id):
+        print(f"❌ Student ID {student_id} not found in database")
+        return jsonify({'success': False, 'message': f'Student ID {student_id} not found'}), 404
+
+    # Check if already enrolled
+    existing_slot = get_fingerprint_slot_for_student(student_id)
+    if existing_slot:
+        print(f"⚠️  Student already enrolled in slot {existing_slot[1]} on {existing_slot[0]}")
+        return jsonify({'success': False, 'message': f'Student already has fingerprint enrolled in slot {existing_slot[1]}'}), 400
+
+    with enrollment_ops_lock:
+        # Each sensor can only run one enrollment at a time
+        if requested_sensor:
+            sensor = fingerprint_hub.get(requested_sensor)
+            if sensor is None:
+                return jsonify({'success': False, 'message': f'Fingerprint reader {requested_sensor} not connected'}), 503
+            if sensor.enrolling:
+                return jsonify({'success': False, 'message': 'Another fingerprint enrollment is in progress on this reader'}), 409
+            candidates = [sensor]
+        else:
+            candidates = [s for s in fingerprint_hub.connected_sensors() if not s.enrolling]
+            if not candidates:
+                return jsonify({'success': False, 'message': 'Another fingerprint enrollment is in progress'}), 409
+
+        # Get next available slot on the least-loaded sensor
+        allocation = get_next_available_fingerprint_slot([s.sensor_id for s in candidates])
+        if allocation is None:
+            return jsonify({'success': False, 'message': 'Fingerprint sensor is full - delete an unused fingerprint first'}), 507
+        sensor = next(s for s in candidates if s.sensor_id == allocation[0])
+        slot = allocation[1]
+        print(f"📍 Using fingerprint slot: {slot} on {sensor.sensor_id}")
+        op = EnrollmentOperation(student_id, sensor.sensor_id, slot)
+        op.add_event('info', op.message)
+        enrollment_ops[op.op_id] = op
+        # Forget the oldest finished operations
+        finished = [oid for oid, o in enrollment_ops.items() if o.state != 'running']
+        for oid in finished[:max(0, len(enrollment_ops) - MAX_ENROLLMENT_OPS_KEPT)]:
+            del enrollment_ops[oid]
+        sensor.enrolling = True  # Set enrollment flag to prevent attendance during enrollment
+
+    threading.Thread(target=_run_enrollment, args=(op, sensor), daemon=True).start()
     return jsonify({
-        'success': False,
-        'message': 'Enrollment timeout - did you place your finger on the sensor?',
-        'responses': responses
-    }), 408
+        'success': True,
+        'op_id': op.op_id,
+        'sensor_id': sensor.sensor_id,
+        'slot': slot,
+        'message': op.message,
+        'status_url': url_for('get_enrollment_status', op=op.op_id)
+    }), 202
 
 @app.route('/enrollment_status')
 def get_enrollment_status():
-    """Get real-time enrollment status messages"""
-    global fingerprint_enrollment_status
-    return jsonify({'messages': fingerprint_enrollment_status})
+    """
+    Progress of an enrollment operation. Pass ?op=<op_id>&cursor=<n> to get only
+    the events after the cursor returned by the previous call. Without op, the
+    latest operation is reported.
+    """
+    op_id = request.args.get('op')
+    cursor = request.args.get('cursor', 0, type=int)
+    with enrollment_ops_lock:
+        op = enrollment_ops.get(op_id) if op_id else next(reversed(enrollment_ops.values()), None)
+    if op is None:
+        if op_id:
+            return jsonify({'success': False, 'message': 'Unknown enrollment operation'}), 404
+        return jsonify({'state': 'idle', 'events': [], 'cursor': 0, 'messages': []})
+    status = op.status(cursor)
+    status['messages'] = status['events']  # Older clients read 'messages'
+    return jsonify(status)
+
+def _process_fingerprint_match(sensor_id, data):
+    """Resolves a sensor match to a student and marks attendance. Returns the match info, or None."""
+    slot_id = data.get('id')
+    confidence = data.get('confidence')
+    print(f"   👆 Processing match: Sensor {sensor_id}, Slot {slot_id}, Confidence {confidence}")
 
-@app.route('/get_fingerprint_matches')
-def get_fingerprint_matches():
-    """Get fingerprint matches from queue - only processes if sensor is activated"""
-    global fingerprint_sensor_activated
-    matches = []
-    queue_size = fingerprint_queue.qsize()
-    
-    print(f"\n🔍 Checking fingerprint queue (size: {queue_size})")
-    
-    # Only process matches if sensor is activated for attendance
-    if not fingerprint_sensor_activated:
-        print(f"   ⏸️  Sensor not activated - skipping match processing")
-        # Clear any old matches from queue
-        while not fingerprint_queue.empty():
+    try:
+        # Reverse lookup: (sensor, slot) -> student_id
+        student_id = fingerprint_slots.student_at(sensor_id, slot_id)
+        if student_id is None:
+            print(f"   ❌ Slot {slot_id} on {sensor_id} not mapped to any student")
+            return None
+        print(f"   ✅ Matched to Student ID: {student_id}")
+
+        name = roster_store.name_of(student_id)
+        if name is None:
+            print(f"   ❌ Student ID {student_id} not found in database!")
+            return None
+        print(f"   👤 Student Name: {name}")
+
+        attendance = mark_attendance(student_id, name)
+        if attendance.get('status') == 'already_present':
+            print(f"   ⚠️ Attendance already marked for {name}")
+        else:
+            print(f"   ✅ Attendance marked successfully!")
+        return {
+            'student_id': student_id,
+            'name': name,
+            'confidence': confidence,
+            'sensor_id': sensor_id,
+            'attendance': attendance,
+            'timestamp': datetime.datetime.now().strftime("%H:%M:%S"),
+            'status': attendance.get('status', '')
+        }
+    except Exception as e:
+        print(f"   ❌ Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def _drain(q):
+    """Takes everything currently on q and returns it as a list."""
+    items = []
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except queue.Empty:
+            return items
+
+def _put_latest(q, item):
+    """Puts item on a bounded queue, dropping the oldest entry if it is full."""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
             try:
-                fingerprint_queue.get_nowait()
-                print(f"   🗑️  Removed old match from queue")
+                q.get_nowait()
             except queue.Empty:
-                break
-        print(f"   📤 Returning 0 matches (sensor not activated)")
-        return jsonify({'matches': []})
-    
-    while not fingerprint_queue.empty():
+                pass
+
+@app.route('/get_fingerprint_matches')
+def get_fingerprint_matches():
+    """Returns matches the listener resolved since the last poll (for clients without /fingerprint_stream)."""
+    global fingerprint_last_poll
+    fingerprint_last_poll = time.monotonic()
+    return jsonify({'matches': _drain(fingerprint_queue)})
+
+@app.route('/fingerprint_stream')
+def fingerprint_stream():
+    """Server-Sent Events stream of fingerprint matches, pushed as soon as the listener resolves them."""
+    def stream():
+        subscriber = fingerprint_events.subscribe()
         try:
-            data = fingerprint_queue.get_nowait()
-            slot_id = data.get('id')
-            confidence = data.get('confidence')
-            
-            print(f"   � Processing match: Slot {slot_id}, Confidence {confidence}")
-            
-            # Find student by fingerprint slot
-            if not os.path.exists(FINGERPRINT_MAP_FILE):
-                print(f"   ❌ fingerprint_map.json not found!")
-                print(f"   Please enroll fingerprints through the enrollment page first.")
-                continue
-                
-            with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                fp_map = json.load(f)
-                print(f"   📋 Current mappings: {fp_map}")
-                
-                # Reverse lookup: slot -> student_id
-                student_found = False
-                for student_id, mapped_slot in fp_map.items():
-                    if mapped_slot == slot_id:
-                        student_found = True
-                        print(f"   ✅ Matched to Student ID: {student_id}")
-                        
-                        df = get_df()
-                        student_row = df[df['student_id'] == student_id]
-                        
-                        if not student_row.empty:
-                            name = student_row.iloc[0]['name']
-                            print(f"   👤 Student Name: {name}")
-                            print(f"   📝 Marking attendance...")
-                            
-                            attendance = mark_attendance(student_id, name)
-                            match_info = {
-                                'student_id': student_id,
-                                'name': name,
-                                'confidence': confidence,
-                                'attendance': attendance,
-                                'timestamp': datetime.datetime.now().strftime("%H:%M:%S"),
-                                'status': attendance.get('status', '')
-                            }
-                            matches.append(match_info)
-                            if attendance.get('status') == 'already_present':
-                                print(f"   ⚠️ Attendance already marked for {name}")
-                            else:
-                                print(f"   ✅ Attendance marked successfully!")
-                            print(f"   Status: {attendance}\n")
-                        else:
-                            print(f"   ❌ Student ID {student_id} not found in database!")
-                        break
-                
-                if not student_found:
-                    print(f"   ❌ Slot {slot_id} not mapped to any student")
-                    print(f"   Available mappings: {fp_map}")
-                    
-        except queue.Empty:
-            break
-        except Exception as e:
-            print(f"   ❌ Error: {e}")
-            import traceback
-            traceback.print_exc()
-    
-    print(f"   📤 Returning {len(matches)} matches to frontend")
-    return jsonify({'matches': matches})
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    match_info = subscriber.get(timeout=FINGERPRINT_STREAM_HEARTBEAT)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: match\ndata: {json.dumps(match_info, default=str)}\n\n"
+        finally:
+            fingerprint_events.unsubscribe(subscriber)
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/delete_fingerprint/<string:student_id>', methods=['POST'])
 def delete_fingerprint(student_id):
     """Delete a student's fingerprint"""
-    slot = get_fingerprint_slot_for_student(student_id)
-    if not slot:
+    enrolled_slot = get_fingerprint_slot_for_student(student_id)
+    if not enrolled_slot:
         return jsonify({'success': False, 'message': 'No fingerprint found for this student'}), 404
+    sensor_id, slot = enrolled_slot
     
-    if not fingerprint_connected:
+    if not fingerprint_hub.get(sensor_id):
         # Just remove from mapping
-        if os.path.exists(FINGERPRINT_MAP_FILE):
-            with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                fp_map = json.load(f)
-            if str(student_id) in fp_map:
-                del fp_map[str(student_id)]
-                with open(FINGERPRINT_MAP_FILE, 'w') as f:
-                    json.dump(fp_map, f, indent=2)
+        fingerprint_slots.release(student_id)
         return jsonify({'success': True, 'message': 'Fingerprint mapping removed (reader offline)'}), 200
     
-    # Send delete command
-    send_fingerprint_command(f"DELETE:{slot}")
-    response = read_fingerprint_response(timeout=5)
+    # Send delete command to the sensor holding the template
+    response = delete_fingerprint_from_sensor(sensor_id, slot)
     
     if response and response.get('success'):
         # Remove from mapping
-        if os.path.exists(FINGERPRINT_MAP_FILE):
-            with open(FINGERPRINT_MAP_FILE, 'r') as f:
-                fp_map = json.load(f)
-            if str(student_id) in fp_map:
-                del fp_map[str(student_id)]
-                with open(FINGERPRINT_MAP_FILE, 'w') as f:
-                    json.dump(fp_map, f, indent=2)
+        fingerprint_slots.release(student_id)
         return jsonify({'success': True, 'message': f'Fingerprint deleted from slot {slot}'})
     
     return jsonify({'success': False, 'message': 'Failed to delete fingerprint from sensor'}), 500
 
+def _requested_sensors():
+    """The connected sensor named by ?sensor= (or a JSON 'sensor'), or every connected sensor"""
+    data = request.get_json(silent=True) or {}
+    sensor_id = request.args.get('sensor', data.get('sensor'))
+    if sensor_id:
+        sensor = fingerprint_hub.get(sensor_id)
+        return [sensor] if sensor else []
+    return fingerprint_hub.connected_sensors()
+
 @app.route('/fingerprint_activate', methods=['POST'])
 def fingerprint_activate():
-    """Activate fingerprint sensor for attendance verification"""
-    global fingerprint_sensor_activated
-    
-    if not fingerprint_connected:
+    """Activate fingerprint sensors (all, or ?sensor=<id>) for attendance verification"""
+    sensors = _requested_sensors()
+    if not sensors:
         return jsonify({'success': False, 'message': 'Fingerprint reader not connected'}), 503
     
     print("\n🔌 Activating fingerprint sensor for attendance...")
-    fingerprint_sensor_activated = True  # Set flag to allow attendance marking
-    
-    # Send activation command to ESP32
-    send_fingerprint_command("ACTIVATE")
+    # Matches from an earlier session must not reach this session's pollers
+    _drain(fingerprint_queue)
+    for sensor in sensors:
+        sensor.activated = True  # Set flag to allow attendance marking
+        # Send activation command to ESP32
+        send_fingerprint_command("ACTIVATE", sensor.sensor_id)
     
     # Wait a moment for activation
     time.sleep(0.5)
     
     # Start continuous verification mode
     print("🔍 Starting continuous verification...")
-    send_fingerprint_command("VERIFY")
+    for sensor in sensors:
+        # VERIFY would cancel an enrollment in progress on this reader
+        if not sensor.enrolling:
+            send_fingerprint_command("VERIFY", sensor.sensor_id)
     
     print("✅ Sensor activated and verification started")
     print(f"   Attendance marking: ENABLED")
@@ -1312,16 +3282,15 @@ def fingerprint_activate():
 
 @app.route('/fingerprint_deactivate', methods=['POST'])
 def fingerprint_deactivate():
-    """Deactivate fingerprint sensor to save power"""
-    global fingerprint_sensor_activated
-    
-    if not fingerprint_connected:
+    """Deactivate fingerprint sensors (all, or ?sensor=<id>) to save power"""
+    sensors = _requested_sensors()
+    if not sensors:
         return jsonify({'success': False, 'message': 'Fingerprint reader not connected'}), 503
     
-    fingerprint_sensor_activated = False  # Disable attendance marking
-    
-    # Send deactivation command to ESP32
-    send_fingerprint_command("DEACTIVATE")
+    for sensor in sensors:
+        sensor.activated = False  # Disable attendance marking
+        # Send deactivation command to ESP32
+        send_fingerprint_command("DEACTIVATE", sensor.sensor_id)
     
     print("🔌 Sensor deactivated - Attendance marking: DISABLED")
     app.logger.info("Fingerprint sensor deactivated to save power")
@@ -1334,50 +3303,29 @@ def get_today_attendance_list():
     who currently exist in the main students_data.csv file.
     """
     # First, get the list of currently valid student IDs
-    main_df = get_df()
-    if main_df.empty:
+    valid_student_ids = roster_store.ids()
+    if not valid_student_ids:
         return jsonify([]) # If there are no students, there's no valid attendance
-    valid_student_ids = main_df['student_id'].tolist()
 
     # Now, read today's attendance log
     today_str = datetime.date.today().strftime("%Y-%m-%d")
-    attendance_file = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today_str}.csv")
-
-    if os.path.exists(attendance_file):
-        try:
-            att_df = pd.read_csv(attendance_file, dtype={'Student ID': str})
-            # Filter the attendance records to only include valid students
-            att_df_filtered = att_df[att_df['Student ID'].isin(valid_student_ids)]
+    valid_student_ids = set(valid_student_ids)
 
-            # Rename columns for the frontend
-            att_df_filtered = att_df_filtered.rename(columns={'Student ID': 'id', 'Name': 'name', 'Time': 'timestamp'})
-            
-            # Return the filtered list
-            return jsonify(att_df_filtered.to_dict(orient='records'))
-        except (pd.errors.EmptyDataError, KeyError):
-            # Handles cases where the attendance file is empty or malformed
-            return jsonify([])
-            
-    return jsonify([]) # No attendance file for today
+    # Filter the attendance records to only include valid students, renamed for the frontend
+    return jsonify([
+        {'id': event['Student ID'], 'name': event['Name'], 'timestamp': event['Time']}
+        for event in attendance_ledger.events(today_str)
+        if event['Student ID'] in valid_student_ids
+    ])
 
 @app.route('/get_today_attendance', methods=['GET'])
 def get_today_attendance():
     """A dedicated route for live_attendance page to get today's data."""
-    df = get_df()
-    total_students = len(df)
+    total_students = len(roster_store.ids())
     
     today_str = datetime.date.today().strftime("%Y-%m-%d")
-    attendance_file = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today_str}.csv")
-    present_list = []
-    present_count = 0
-    
-    if os.path.exists(attendance_file):
-        try:
-            att_df = pd.read_csv(attendance_file, dtype={'Student ID': str})
-            present_list = att_df.to_dict(orient='records')
-            present_count = len(att_df)
-        except pd.errors.EmptyDataError:
-            pass # File is empty, which is fine
+    present_list = attendance_ledger.events(today_str)
+    present_count = len(present_list)
             
     return jsonify({
         'total_students': total_students,
@@ -1386,9 +3334,15 @@ def get_today_attendance():
     })
 
 # --- Analysis, Visualization and Stats Routes ---
-def get_trained_model_and_data(df):
-    """Helper function to train the model required for analysis and intervention."""
-    feature_cols = ['attendance_percentage', 'test_score_1', 'test_score_2', 'assignment_score']
+PREDICTION_FEATURES = ('attendance_percentage', 'test_score_1', 'test_score_2', 'assignment_score')
+PREDICTION_MODELS = {
+    'LinearRegression': lambda: LinearRegression(),
+    'DecisionTreeRegressor': lambda: DecisionTreeRegressor(random_state=42),
+}
+
+def clean_prediction_data(df, feature_cols=PREDICTION_FEATURES):
+    """Coerces the feature and target columns of df to numbers in place and returns df."""
+    feature_cols = list(feature_cols)
 
     # CLEANING: Normalize attendance values that may be stored as strings
     # Examples supported: '75%', '2/2', '2/2 days', '100.0', numeric
@@ -1424,24 +3378,65 @@ def get_trained_model_and_data(df):
         else:
             # If a feature is missing, create it as NaN so dropna works consistently
             df[col] = np.nan
+    return df
 
-    train_df = df.dropna(subset=feature_cols + ['final_exam_score'])
-
-    if len(train_df) < 2:
-        return None, None, "Not enough complete student records (with final scores) to train a prediction model."
-
-    # Use LinearRegression for stable predictions
-    from sklearn.linear_model import LinearRegression
-    n_train = len(train_df)
-    model = LinearRegression()
-
-    # Debug: show basic training stats
-    print(f"[DEBUG] Training model ({model.__class__.__name__}) on {n_train} samples")
-    print(train_df[feature_cols + ['final_exam_score']])
+class PredictionModelRegistry:
+    """Fitted final-score models, trained once per roster version.
 
-    model.fit(train_df[feature_cols], train_df['final_exam_score'])
+    Models are cached by (roster version, model type, feature columns). Any
+    roster change bumps roster_store.version, so the next request trains on
+    the new data and the models of older versions are dropped. Repeated
+    what-if and intervention requests reuse the fitted model instead of
+    cleaning the roster and fitting again.
+    """
 
-    return model, feature_cols, None
+    def __init__(self, roster):
+        self.roster = roster
+        self._lock = threading.Lock()
+        self._models = {}  # (version, model_type, features) -> (model, feature_cols, error)
+
+    def get(self, model_type='LinearRegression', features=PREDICTION_FEATURES):
+        """Returns (model, feature_cols, error) for the current roster; error is set when it can't be trained."""
+        if model_type not in PREDICTION_MODELS:
+            model_type = 'LinearRegression'
+        features = tuple(features)
+        key = (self.roster.current_version(), model_type, features)
+        entry = self._models.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            version, df = self.roster.snapshot()
+            key = (version, model_type, features)
+            entry = self._models.get(key)
+            if entry is None:
+                entry = self._train(df, model_type, list(features))
+                self._models = {k: v for k, v in self._models.items() if k[0] == version}
+                self._models[key] = entry
+            return entry
+
+    @staticmethod
+    def _train(df, model_type, feature_cols):
+        clean_prediction_data(df, feature_cols)
+        train_df = df.dropna(subset=feature_cols + ['final_exam_score'])
+
+        if len(train_df) < 2:
+            return None, None, "Not enough complete student records (with final scores) to train a prediction model."
+
+        model = PREDICTION_MODELS[model_type]()
+
+        # Debug: show basic training stats
+        print(f"[DEBUG] Training model ({model.__class__.__name__}) on {len(train_df)} samples")
+        print(train_df[feature_cols + ['final_exam_score']])
+
+        model.fit(train_df[feature_cols], train_df['final_exam_score'])
+        return model, feature_cols, None
+
+prediction_models = PredictionModelRegistry(roster_store)
+
+def get_trained_model_and_data(df, model_type='LinearRegression'):
+    """Cleans df (a roster from get_df()) in place and returns the cached model for the current roster."""
+    clean_prediction_data(df)
+    return prediction_models.get(model_type)
 
 def send_parent_notification(student):
     parent_phone = student.get('parent_phone', None)
@@ -1453,49 +3448,31 @@ def send_parent_notification(student):
 
 @app.route('/analyze_performance', methods=['POST'], endpoint='analyze_performance_route')
 def analyze_performance_route():
-    df = get_df()
-    model, feature_cols, error = get_trained_model_and_data(df)
-    
-    if error:
-        flash(error, 'warning')
-        return redirect(url_for('index'))
+    with roster_store.locked():
+        df = get_df()
+        model_choice = request.form.get('model_choice', 'DecisionTreeRegressor')
+        # Use the selected model for prediction
+        model, feature_cols, error = get_trained_model_and_data(df, model_choice)
     
-    model_choice = request.form.get('model_choice', 'DecisionTreeRegressor')
-    # Use the selected model for prediction
-    if model_choice == 'LinearRegression':
-        model = LinearRegression()
-        model.fit(df.dropna(subset=feature_cols + ['final_exam_score'])[feature_cols], df.dropna(subset=feature_cols + ['final_exam_score'])['final_exam_score'])
-    elif model_choice == 'DecisionTreeRegressor':
-        model = DecisionTreeRegressor(random_state=42)
-        model.fit(df.dropna(subset=feature_cols + ['final_exam_score'])[feature_cols], df.dropna(subset=feature_cols + ['final_exam_score'])['final_exam_score'])
-
-    # Debug: Print training data
-    print("\n[DEBUG] Training data for model:")
-    print(df.dropna(subset=feature_cols + ['final_exam_score'])[[*feature_cols, 'final_exam_score']])
-    print("[DEBUG] Features used for prediction:", feature_cols)
-
-    predict_mask = df[feature_cols].notnull().all(axis=1)
-    if predict_mask.any():
-        print("[DEBUG] Data used for prediction:")
-        print(df.loc[predict_mask, feature_cols])
-        predicted_scores = model.predict(df.loc[predict_mask, feature_cols])
-        print("[DEBUG] Predicted scores:", predicted_scores)
-        df.loc[predict_mask, 'final_exam_score'] = np.clip(predicted_scores, 0, 100)
+        if error:
+            flash(error, 'warning')
+            return redirect(url_for('index'))
+
+        # Debug: Print training data
+        print("\n[DEBUG] Training data for model:")
+        print(df.dropna(subset=feature_cols + ['final_exam_score'])[[*feature_cols, 'final_exam_score']])
+        print("[DEBUG] Features used for prediction:", feature_cols)
+
+        predict_mask = df[feature_cols].notnull().all(axis=1)
+        if predict_mask.any():
+            print("[DEBUG] Data used for prediction:")
+            print(df.loc[predict_mask, feature_cols])
+            predicted_scores = model.predict(df.loc[predict_mask, feature_cols])
+            print("[DEBUG] Predicted scores:", predicted_scores)
+            df.loc[predict_mask, 'final_exam_score'] = np.clip(predicted_scores, 0, 100)
     
-    def categorize(row):
-        if pd.isna(row['final_exam_score']):
-            return "N/A"
-        if row['attendance_percentage'] < 50:
-            return "At Risk"
-        if row['final_exam_score'] < 50:
-            return "At Risk"
-        if row['final_exam_score'] < 70:
-            return "Average"
-        if row['final_exam_score'] < 85:
-            return "Good"
-        return "Excellent"
-    df['performance_category'] = df.apply(categorize, axis=1)
-    save_df(df)
+        df['performance_category'] = performance_categories(df['final_exam_score'], df['attendance_percentage'])
+        save_df(df)
     
     flash(f"Performance analysis complete using {model_choice} model.", "success")
     role = session.get('role')
@@ -1509,6 +3486,42 @@ def analyze_performance_route():
     return render_template('analysis_results.html', at_risk_students=at_risk_students)
 
 
+# --- Intervention Suggestions ---
+INTERVENTION_STEP = 15  # Points (percentage points for attendance) each scenario adds, capped at 100
+INTERVENTION_SCENARIOS = [
+    {'key': 'attendance', 'feature': 'attendance_percentage', 'label': 'Improve Attendance',
+     'message': 'Focus on improving attendance by 15%.'},
+    {'key': 'test1', 'feature': 'test_score_1', 'label': 'Improve Test 1 Score',
+     'message': 'Target a 15 point improvement on Test 1.'},
+    {'key': 'assignment', 'feature': 'assignment_score', 'label': 'Improve Assignment Score',
+     'message': 'Focus on raising the Assignment score by 15 points.'},
+]
+
+def score_interventions(model, feature_cols, features):
+    """
+    Scores the baseline and every scenario for all rows of features in one
+    model.predict call. Returns (base_scores, boosts); boosts has one column
+    per entry of INTERVENTION_SCENARIOS.
+    """
+    features = features[feature_cols].astype(float).reset_index(drop=True)
+    if features.empty:
+        return np.empty(0), np.empty((0, len(INTERVENTION_SCENARIOS)))
+    blocks = [features]
+    for scenario in INTERVENTION_SCENARIOS:
+        block = features.copy()
+        block[scenario['feature']] = np.minimum(100, block[scenario['feature']] + INTERVENTION_STEP)
+        blocks.append(block)
+    predictions = model.predict(pd.concat(blocks, ignore_index=True)).reshape(len(blocks), len(features))
+    base_scores = predictions[0]
+    return base_scores, predictions[1:].T - base_scores[:, None]
+
+def _intervention_suggestion(base_score, boosts):
+    best = int(np.argmax(boosts))
+    max_boost = boosts[best]
+    if max_boost > 0:
+        return f"The most impactful action is to **{INTERVENTION_SCENARIOS[best]['message']}**! This is predicted to increase the final score by **{max_boost:.2f} points** (from {base_score:.2f} to {base_score + max_boost:.2f})."
+    return f"No single intervention yielded a significant boost. Current predicted score is {base_score:.2f}. Suggest a holistic review of all scores."
+
 @app.route('/get_intervention_suggestion', methods=['POST'])
 def get_intervention_suggestion():
     """NEW ROUTE: Calculates the most impactful intervention for a specific student."""
@@ -1522,52 +3535,14 @@ def get_intervention_suggestion():
         if student_data[['test_score_1', 'test_score_2', 'assignment_score', 'attendance_percentage']].isnull().any():
             return jsonify({'suggestion': 'Data incomplete. Please ensure all assessment scores are entered to run a personalized analysis.'})
 
-        model, feature_cols, error = get_trained_model_and_data(df)
+        model, feature_cols, error = prediction_models.get('LinearRegression')
         
         if error:
             return jsonify({'suggestion': f'Cannot generate suggestion: {error}'})
 
-        # Base data for prediction
-        base_data = student_data[feature_cols].to_dict()
-        base_score = model.predict(pd.DataFrame([base_data], columns=feature_cols))[0]
-        
-        # Define scenarios for testing impact
-        scenarios = {
-            'attendance': {
-                'label': 'Improve Attendance',
-                'change': {'attendance_percentage': min(100, base_data['attendance_percentage'] + 15)}, # 15% boost
-                'message': 'Focus on improving attendance by 15%.'
-            },
-            'test1': {
-                'label': 'Improve Test 1 Score',
-                'change': {'test_score_1': min(100, base_data['test_score_1'] + 15)}, # 15 point boost
-                'message': 'Target a 15 point improvement on Test 1.'
-            },
-            'assignment': {
-                'label': 'Improve Assignment Score',
-                'change': {'assignment_score': min(100, base_data['assignment_score'] + 15)}, # 15 point boost
-                'message': 'Focus on raising the Assignment score by 15 points.'
-            }
-        }
-        
-        max_boost = -1
-        best_scenario = None
-        
-        for key, scenario in scenarios.items():
-            test_data = base_data.copy()
-            test_data.update(scenario['change'])
-            
-            predicted_score = model.predict(pd.DataFrame([test_data], columns=feature_cols))[0]
-            boost = predicted_score - base_score
-            
-            if boost > max_boost:
-                max_boost = boost
-                best_scenario = scenario
-
-        if best_scenario and max_boost > 0:
-            final_suggestion = f"The most impactful action is to **{best_scenario['message']}**! This is predicted to increase the final score by **{max_boost:.2f} points** (from {base_score:.2f} to {base_score + max_boost:.2f})."
-        else:
-            final_suggestion = f"No single intervention yielded a significant boost. Current predicted score is {base_score:.2f}. Suggest a holistic review of all scores."
+        # Baseline and every scenario scored together
+        base_scores, boosts = score_interventions(model, feature_cols, pd.DataFrame([student_data[feature_cols].to_dict()]))
+        final_suggestion = _intervention_suggestion(base_scores[0], boosts[0])
         
         return jsonify({'suggestion': final_suggestion, 'student_name': student_data['name']})
 
@@ -1577,9 +3552,50 @@ def get_intervention_suggestion():
         app.logger.error(f"Error generating intervention: {e}")
         return jsonify({'suggestion': f'An error occurred: {str(e)}'})
 
+@app.route('/get_intervention_suggestions', methods=['POST'])
+def get_intervention_suggestions():
+    """
+    Ranked interventions for a whole cohort from one batched prediction: the
+    students in 'student_ids' if given, otherwise everyone on the early
+    warning (at-risk) list.
+    """
+    data = request.get_json(silent=True) or {}
+    model, feature_cols, error = prediction_models.get('LinearRegression')
+    if error:
+        return jsonify({'error': f'Cannot generate suggestions: {error}'}), 400
+
+    if data.get('student_ids'):
+        df = get_df()
+        cohort = df[df['student_id'].isin([str(sid).strip() for sid in data['student_ids']])]
+    else:
+        cohort = get_at_risk_students()
+    if session.get('role') == 'student':
+        cohort = cohort[cohort['student_id'] == session.get('username')]
+
+    features = cohort[feature_cols].apply(pd.to_numeric, errors='coerce')
+    complete = features.notnull().all(axis=1).to_numpy()
+    base_scores, boosts = score_interventions(model, feature_cols, features[complete])
+    scored = iter(zip(base_scores, boosts))
+
+    students = []
+    for student, is_complete in zip(cohort[['student_id', 'name']].to_dict(orient='records'), complete):
+        if not is_complete:
+            students.append({**student, 'suggestion': 'Data incomplete. Please ensure all assessment scores are entered to run a personalized analysis.', 'interventions': []})
+            continue
+        base_score, student_boosts = next(scored)
+        interventions = [
+            {'key': scenario['key'], 'label': scenario['label'], 'message': scenario['message'],
+             'boost': round(float(boost), 2), 'predicted_score': round(float(base_score + boost), 2)}
+            for scenario, boost in zip(INTERVENTION_SCENARIOS, student_boosts)
+        ]
+        interventions.sort(key=lambda item: item['boost'], reverse=True)
+        students.append({**student, 'base_score': round(float(base_score), 2),
+                         'suggestion': _intervention_suggestion(base_score, student_boosts),
+                         'interventions': interventions})
+    return jsonify({'count': len(students), 'students': students})
+
 @app.route('/what_if_analysis', methods=['POST'])
 def what_if_analysis():
-    df = get_df()
     data = request.json
 
     # UPDATED: The model now requires all four features from the sliders.
@@ -1589,29 +3605,79 @@ def what_if_analysis():
         'test_score_2': float(data['test2']),
         'assignment_score': float(data['assignment'])
     }])
-    feature_cols = ['attendance_percentage', 'test_score_1', 'test_score_2', 'assignment_score']
 
-    for col in feature_cols + ['final_exam_score']:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-    
-    train_df = df.dropna(subset=feature_cols + ['final_exam_score'])
-    if len(train_df) < 2:
+    # Fitted once per roster version; slider moves reuse it
+    model, feature_cols, error = prediction_models.get('LinearRegression')
+    if error:
         return jsonify({'error': 'Not enough data to train a model.'}), 400
     
-    model = LinearRegression()
-    model.fit(train_df[feature_cols], train_df['final_exam_score'])
     predicted_score = model.predict(hypothetical_data[feature_cols])[0]
     predicted_score = np.clip(predicted_score, 0, 100)
 
-    def categorize(score):
-        if pd.isna(score): return "N/A"
-        if score < 50: return "At Risk"
-        if score < 70: return "Average"
-        if score < 85: return "Good"
-        return "Excellent"
-    category = categorize(predicted_score)
+    category = str(score_categories([predicted_score])[0])
 
     return jsonify({'predicted_score': round(predicted_score, 2), 'category': category})
+# --- What-If Prediction Grid ---
+WHAT_IF_GRID_MAX_POINTS = 100000  # Largest prediction surface one request may ask for
+WHAT_IF_INPUTS = {
+    'attendance': 'attendance_percentage',
+    'test1': 'test_score_1',
+    'test2': 'test_score_2',
+    'assignment': 'assignment_score',
+}
+
+def _what_if_axis(spec):
+    """Values of one grid axis: a number, a list of numbers, or {'start', 'stop', 'step'} with stop included."""
+    if isinstance(spec, dict):
+        start, stop, step = float(spec['start']), float(spec['stop']), float(spec.get('step', 1))
+        if step <= 0 or stop < start:
+            raise ValueError('a range needs start <= stop and a positive step')
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        if count > WHAT_IF_GRID_MAX_POINTS:
+            raise ValueError(f'a range may have at most {WHAT_IF_GRID_MAX_POINTS} values')
+        return start + step * np.arange(count)
+    values = np.asarray(spec if isinstance(spec, list) else [spec], dtype=float)
+    if values.size == 0:
+        raise ValueError('an axis needs at least one value')
+    return values
+
+@app.route('/what_if_grid', methods=['POST'])
+def what_if_grid():
+    """
+    Predicts the final score over a whole grid of hypothetical inputs in one
+    model.predict call. Each of attendance/test1/test2/assignment is a number,
+    a list or a {start, stop, step} range; the scores are returned flat in C
+    order over the axes, which are listed in that order, so the page can draw
+    sensitivity curves locally.
+    """
+    data = request.json or {}
+    try:
+        axes = {key: _what_if_axis(data[key]) for key in WHAT_IF_INPUTS}
+    except KeyError as e:
+        return jsonify({'error': f'Missing input: {e.args[0]}'}), 400
+    except (TypeError, ValueError, OverflowError) as e:
+        # OverflowError: an Infinity bound, which the JSON parser accepts
+        return jsonify({'error': f'Invalid input: {e}'}), 400
+    shape = [len(values) for values in axes.values()]
+    if int(np.prod(shape)) > WHAT_IF_GRID_MAX_POINTS:
+        return jsonify({'error': f'The grid has {int(np.prod(shape))} points; the limit is {WHAT_IF_GRID_MAX_POINTS}.'}), 400
+
+    model, feature_cols, error = prediction_models.get(data.get('model', 'LinearRegression'))
+    if error:
+        return jsonify({'error': 'Not enough data to train a model.'}), 400
+
+    mesh = np.meshgrid(*axes.values(), indexing='ij')
+    grid = pd.DataFrame({WHAT_IF_INPUTS[key]: values.ravel() for key, values in zip(axes, mesh)})
+    predicted_scores = np.clip(model.predict(grid[feature_cols]), 0, 100)
+
+    return jsonify({
+        # A list, not an object: jsonify would sort an object's keys out of shape/score order
+        'axes': [{'name': key, 'values': values.tolist()} for key, values in axes.items()],
+        'shape': shape,
+        'predicted_scores': np.round(predicted_scores, 2).tolist(),
+        'categories': score_categories(predicted_scores).tolist(),
+    })
+
 @app.route('/visualizations')
 def visualizations():
     return render_template('visualizations.html')
@@ -1631,53 +3697,127 @@ def get_chart_data():
     grouped_scores = grouped_scores.reindex(category_order, fill_value=0).to_dict()
     return jsonify({'performance_counts': performance_counts, 'score_distribution': score_distribution, 'scatter_data': scatter_data, 'grouped_scores': grouped_scores})
 
-@app.route('/get_complete_stats')
-def get_complete_stats():
-    # Get the main student list to get percentages and a list of valid IDs
-    df = get_df()
-    df = _update_attendance_percentages(df.copy()) # Use a copy to avoid side effects
-    
-    valid_student_ids = df['student_id'].tolist() if not df.empty else []
-    total_students = len(df)
-
-    # Determine today's present count by filtering the attendance log
-    today = datetime.date.today().strftime("%Y-%m-%d")
-    attendance_file = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today}.csv")
-    present_today_count = 0
-    if os.path.exists(attendance_file):
-        try:
-            att_df = pd.read_csv(attendance_file, dtype={'Student ID': str})
-            # THIS IS THE FIX: Filter attendance log to only include valid, existing students
-            att_df_filtered = att_df[att_df['Student ID'].isin(valid_student_ids)]
-            # Count the unique IDs from the *filtered* list
-            present_today_count = len(att_df_filtered['Student ID'].dropna().unique())
-        except (pd.errors.EmptyDataError, KeyError):
-            pass  # If file is empty or malformed, count remains 0
+# --- Dashboard Statistics Cache ---
+class DashboardStatsCache:
+    """
+    The /get_complete_stats payload, kept between polls.
+
+    The cached stats are tagged with (roster version, ledger version, day).
+    Committed attendance marks are folded in by apply_marks(), which only
+    touches the marked students' rows, their percentages and present_today.
+    Any other change rebuilds the stats on the next request. The JSON body
+    and its ETag are produced once per state, so a poll whose If-None-Match
+    still matches is answered with a bare 304.
+    """
 
-    if df.empty:
-        return jsonify({
-            'total_students': 0, 'present_today': 0, 'avg_attendance': 0,
-            'at_risk_count': 0, 'excellent_count': 0, 'good_count': 0,
-            'average_count': 0, 'student_data': {}
-        })
+    def __init__(self, roster, ledger):
+        self.roster = roster
+        self.ledger = ledger
+        self._lock = threading.Lock()
+        self._state = None
+
+    def key(self):
+        return (self.roster.current_version(), self.ledger.current_version(), datetime.date.today().strftime("%Y-%m-%d"))
+
+    def _build(self):
+        day = datetime.date.today().strftime("%Y-%m-%d")
+        ledger_version = self.ledger.current_version()
+        roster_version, df = self.roster.snapshot()
+        df = _update_attendance_percentages(df)
+        # Totals count every roster row, repeated IDs included; student_data keeps
+        # the last row of a repeated ID, as the row-by-row dict did
+        positions = {}
+        for pos, sid in enumerate(df['student_id']):
+            positions.setdefault(sid, []).append(pos)
+        return {
+            'key': (roster_version, ledger_version, day),
+            'positions': positions,  # student_id -> rows of that ID
+            'percentages': np.array(pd.to_numeric(df['attendance_percentage'], errors='coerce'), dtype=float),
+            'present': self.ledger.present_ids(day) & set(positions),
+            'performance_counts': df['performance_category'].value_counts().to_dict() if 'performance_category' in df.columns else {},
+            'student_data': df.drop_duplicates('student_id', keep='last').set_index('student_id', drop=False).to_dict(orient='index'),
+            'body': None,
+            'etag': None,
+        }
 
-    # Calculate other stats from the main DataFrame
-    valid_attendance = pd.to_numeric(df['attendance_percentage'], errors='coerce').dropna()
-    avg_attendance = valid_attendance.mean() if not valid_attendance.empty else 0
-    performance_counts = df['performance_category'].value_counts().to_dict()
+    @staticmethod
+    def _payload(state):
+        if not state['positions']:
+            return {
+                'total_students': 0, 'present_today': 0, 'avg_attendance': 0,
+                'at_risk_count': 0, 'excellent_count': 0, 'good_count': 0,
+                'average_count': 0, 'student_data': {}
+            }
+        percentages = state['percentages'][~np.isnan(state['percentages'])]
+        avg_attendance = float(percentages.mean()) if percentages.size else 0
+        performance_counts = state['performance_counts']
+        return {
+            'total_students': len(state['percentages']),
+            'present_today': len(state['present']),
+            'avg_attendance': round(avg_attendance, 1),
+            'at_risk_count': performance_counts.get('At Risk', 0),
+            'excellent_count': performance_counts.get('Excellent', 0),
+            'good_count': performance_counts.get('Good', 0),
+            'average_count': performance_counts.get('Average', 0),
+            'student_data': state['student_data']
+        }
 
-    student_data = {row['student_id']: row.to_dict() for _, row in df.iterrows()}
+    def response_body(self):
+        """Returns (JSON body, ETag) of the current stats, rebuilding them only if something else changed."""
+        key = self.key()
+        with self._lock:
+            state = self._state
+            if state is None or state['key'] != key:
+                state = self._state = self._build()
+            if state['body'] is None:
+                state['body'] = app.json.response(self._payload(state)).get_data()
+                state['etag'] = hashlib.sha1(state['body']).hexdigest()
+            return state['body'], state['etag']
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+    def apply_marks(self, marks, before_key, roster_saved):
+        """
+        Folds freshly committed marks into the cached stats. before_key is
+        key() from just before the commit; if anything besides this commit
+        moved the versions (a new day, an edit, another process), the cache
+        is dropped instead.
+        """
+        with self._lock:
+            state = self._state
+            if state is None or state['key'] != before_key:
+                return
+            day = before_key[2]
+            expected_key = (before_key[0] + (1 if roster_saved else 0), before_key[1] + (1 if marks else 0), day)
+            if self.key() != expected_key or any(mark['day'] != day for mark in marks):
+                self._state = None
+                return
+            student_ids = [mark['student_id'] for mark in marks if mark['student_id'] in state['positions']]
+            for student_id, percentage in zip(student_ids, self.ledger.percentages(student_ids)):
+                student = self.roster.get(student_id)
+                if student is None:
+                    self._state = None
+                    return
+                student['attendance_percentage'] = percentage
+                state['student_data'][student_id] = student
+                state['percentages'][state['positions'][student_id]] = percentage
+                state['present'].add(student_id)
+            state['key'] = expected_key
+            state['body'] = None
+
+dashboard_stats = DashboardStatsCache(roster_store, attendance_ledger)
+
+@app.route('/get_complete_stats')
+def get_complete_stats():
+    # Served from the stats cache; polls with a current If-None-Match get a 304
+    body, etag = dashboard_stats.response_body()
+    response = app.response_class(body, mimetype=app.json.mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
-    return jsonify({
-        'total_students': total_students,
-        'present_today': present_today_count,
-        'avg_attendance': round(avg_attendance, 1),
-        'at_risk_count': performance_counts.get('At Risk', 0),
-        'excellent_count': performance_counts.get('Excellent', 0),
-        'good_count': performance_counts.get('Good', 0),
-        'average_count': performance_counts.get('Average', 0),
-        'student_data': student_data
-    })
 @app.route('/get_live_attendance_stats')
 def get_live_attendance_stats():
     """
@@ -1685,34 +3825,25 @@ def get_live_attendance_stats():
     specifically for the live_attendance.html page.
     """
     # Get the list of all currently valid students
-    main_df = get_df()
-    if main_df.empty:
+    valid_student_ids = roster_store.ids()
+    if not valid_student_ids:
         return jsonify({
             'total_students': 0,
             'present_count': 0,
             'present_list': []
         })
         
-    total_students = len(main_df)
-    valid_student_ids = main_df['student_id'].tolist()
+    total_students = len(valid_student_ids)
 
-    # Read and filter today's attendance log
+    # Read and filter today's attendance log against valid student IDs
     today_str = datetime.date.today().strftime("%Y-%m-%d")
-    attendance_file = os.path.join(ATTENDANCE_FOLDER, f"attendance_{today_str}.csv")
-    present_list = []
-    present_count = 0
-
-    if os.path.exists(attendance_file):
-        try:
-            att_df = pd.read_csv(attendance_file, dtype={'Student ID': str})
-            # The crucial step: filter the log against valid student IDs
-            att_df_filtered = att_df[att_df['Student ID'].isin(valid_student_ids)]
-            present_count = len(att_df_filtered)
-            # Rename columns for the frontend
-            att_df_filtered = att_df_filtered.rename(columns={'Student ID': 'id', 'Name': 'name', 'Time': 'timestamp'})
-            present_list = att_df_filtered.to_dict(orient='records')
-        except (pd.errors.EmptyDataError, KeyError):
-            pass # File is empty or malformed, defaults are fine
+    valid_student_ids = set(valid_student_ids)
+    present_list = [
+        {'id': event['Student ID'], 'name': event['Name'], 'timestamp': event['Time']}
+        for event in attendance_ledger.events(today_str)
+        if event['Student ID'] in valid_student_ids
+    ]
+    present_count = len(present_list)
 
     return jsonify({
         'total_students': total_students,
@@ -1736,6 +3867,43 @@ def ews_dashboard():
         at_risk_students = at_risk_students[at_risk_students['student_id'] == username]
     return render_template('ews_dashboard.html', students=at_risk_students)
 
+# --- CLI Commands ---
+@app.cli.command('import-storage')
+@click.option('--db', 'db_path', default=SQLITE_DB_FILE, show_default=True, help='SQLite database to fill.')
+def import_storage_command(db_path):
+    """Copy the CSV/JSON data files into a SQLite database.
+
+    Run with TRACQUE_STORAGE=sqlite afterwards to serve from it. Existing
+    attendance marks are kept; roster, users, id map and fingerprint slots
+    are replaced by the files' contents.
+    """
+    # Only reads the files; a CSV-backed server may be writing them meanwhile
+    source = create_storage('csv', read_only=True)
+    copied = SqliteStorage(db_path).import_from(source)
+    for name, count in copied.items():
+        click.echo(f"{name}: {count}")
+    click.echo(f"Imported into {db_path}")
+
+def _archive_cutoff(ctx, param, value):
+    """Click callback: --before as a normalized YYYY-MM-DD no later than today."""
+    if value is None:
+        return None
+    try:
+        day = datetime.date.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter(f"'{value}' is not a YYYY-MM-DD date")
+    if day > datetime.date.today():
+        raise click.BadParameter(f"{day.isoformat()} is in the future; today's open day cannot be archived")
+    return day.isoformat()
+
+@app.cli.command('compact-attendance')
+@click.option('--before', 'before_day', default=None, callback=_archive_cutoff,
+              help='Archive days before this date (YYYY-MM-DD, at most today); defaults to today.')
+def compact_attendance_command(before_day):
+    """Move closed attendance days into the columnar archive."""
+    archived = attendance_ledger.compact(before_day)
+    click.echo(f"Archived {len(archived)} days" + (f" ({archived[0]} to {archived[-1]})" if archived else ''))
+
 if __name__ == '__main__':
     for folder in [ATTENDANCE_FOLDER, FACES_FOLDER, MODELS_FOLDER, 'daily_attendance']:
         os.makedirs(folder, exist_ok=True)
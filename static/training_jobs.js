@@ -0,0 +1,32 @@
+// Polls a background training job (see /train_model) until it finishes.
+// Resolves with the final job; onProgress gets the job while it is still running.
+// Rejects with an Error carrying the server's message when the job is unknown
+// (pruned, or started on another worker) or the reply makes no sense, instead
+// of polling forever.
+function waitForTrainingJob(jobId, onProgress) {
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(`/train_model/status/${jobId}`)
+                .then(res => res.json()
+                    .catch(() => ({}))
+                    .then(job => {
+                        if (!res.ok) {
+                            throw new Error(job.message || `Training status unavailable (HTTP ${res.status})`);
+                        }
+                        return job;
+                    }))
+                .then(job => {
+                    if (job.state === 'completed' || job.state === 'failed') {
+                        resolve(job);
+                    } else if (job.state === 'queued' || job.state === 'running') {
+                        if (onProgress && job.total) onProgress(job);
+                        setTimeout(poll, 1000);
+                    } else {
+                        throw new Error(`Unexpected training job state: ${job.state}`);
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
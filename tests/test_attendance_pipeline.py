@@ -0,0 +1,93 @@
+"""
+AttendanceCommitPipeline: concurrent marks are batched into one roster
+write, every caller gets its own result, and commit errors and stalls reach
+the callers instead of hanging them.
+"""
+import threading
+
+import pandas as pd
+import pytest
+
+import app
+
+
+@pytest.fixture
+def isolated(tmp_path, monkeypatch):
+    """Points the roster, ledger and stats cache at a fresh database; returns the roster writes made."""
+    storage = app.SqliteStorage(str(tmp_path / 'tracque.db'))
+    storage.save_roster(pd.DataFrame({
+        'student_id': ['S1', 'S2', 'S3', 'S4'],
+        'name': ['Ann', 'Ben', 'Cal', 'Dee'],
+        'attendance_percentage': 0.0,
+        'test_score_1': 0, 'test_score_2': 0, 'assignment_score': 0,
+        'final_exam_score': float('nan'), 'performance_category': 'N/A',
+        'days_present': 0, 'total_days': 0,
+    }))
+    roster_writes = []
+    save_roster = storage.save_roster
+    monkeypatch.setattr(storage, 'save_roster', lambda df: (roster_writes.append(len(df)), save_roster(df)))
+    roster = app.RosterStore(storage)
+    ledger = app.AttendanceLedger(storage)
+    monkeypatch.setattr(app, 'roster_store', roster)
+    monkeypatch.setattr(app, 'attendance_ledger', ledger)
+    monkeypatch.setattr(app, 'dashboard_stats', app.DashboardStatsCache(roster, ledger))
+    return roster_writes
+
+def submit_together(pipeline, student_ids):
+    """Submits every ID from its own thread at once; returns each caller's result or exception, in order."""
+    results = [None] * len(student_ids)
+    start = threading.Barrier(len(student_ids))
+
+    def submit(i, student_id):
+        start.wait()
+        try:
+            results[i] = pipeline.submit(student_id, student_id)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=submit, args=(i, sid)) for i, sid in enumerate(student_ids)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def test_concurrent_marks_share_one_roster_write(isolated):
+    pipeline = app.AttendanceCommitPipeline(app._commit_attendance_batch, window=0.5, timeout=10)
+    results = submit_together(pipeline, ['S1', 'S2', 'S3', 'S1', 'NOPE'])
+
+    assert len(isolated) == 1
+    statuses = [result['status'] for result in results]
+    assert statuses[1:3] == ['marked', 'marked']
+    # The same student twice in one batch: one caller marks, the other is told they are already present
+    assert sorted(statuses[0:4:3]) == ['already_present', 'marked']
+    assert statuses[4] == 'not_found'
+    roster = app.roster_store.frame().set_index('student_id')
+    assert roster.loc[['S1', 'S2', 'S3', 'S4'], 'days_present'].tolist() == [1, 1, 1, 0]
+
+def test_commit_error_reaches_every_caller():
+    def commit(batch):
+        raise OSError('disk full')
+
+    pipeline = app.AttendanceCommitPipeline(commit, window=0.5, timeout=10)
+    results = submit_together(pipeline, ['S1', 'S2'])
+    assert all(isinstance(result, OSError) for result in results)
+
+def test_stuck_commit_times_out_and_withdraws_waiting_marks():
+    release = threading.Event()
+    committed = []
+
+    def commit(batch):
+        release.wait(10)  # Wedged, e.g. on a file lock held by another process
+        committed.extend(mark['student_id'] for mark in batch)
+        return [{'status': 'marked', 'percentage': 100.0}] * len(batch)
+
+    pipeline = app.AttendanceCommitPipeline(commit, window=0, timeout=0.3)
+    with pytest.raises(TimeoutError, match='may still be written'):
+        pipeline.submit('S1', 'Ann')  # Taken by the committer, which then hangs
+    with pytest.raises(TimeoutError, match='was not written'):
+        pipeline.submit('S2', 'Ben')  # Still queued behind it
+    release.set()
+    # The committer carries on, skipping the withdrawn mark
+    assert pipeline.submit('S3', 'Cal')['status'] == 'marked'
+    assert committed == ['S1', 'S3']
@@ -0,0 +1,91 @@
+"""
+The whole-column derivations in app.py against the per-row lambdas they
+replaced, which are kept here as the reference.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+
+# --- Row-wise reference versions ---
+def old_day_count(x):
+    return 0 if pd.isna(x) or x == '' else int(float(x))
+
+def old_attendance_percentage(days_present, total_days):
+    return round((int(days_present) / int(total_days)) * 100, 2) if int(total_days) > 0 else 0.0
+
+def old_score_category(score):
+    if pd.isna(score): return "N/A"
+    if score < 50: return "At Risk"
+    if score < 70: return "Average"
+    if score < 85: return "Good"
+    return "Excellent"
+
+def old_performance_category(row):
+    if pd.isna(row['final_exam_score']): return "N/A"
+    if row['attendance_percentage'] < 50: return "At Risk"
+    if row['final_exam_score'] < 50: return "At Risk"
+    if row['final_exam_score'] < 70: return "Average"
+    if row['final_exam_score'] < 85: return "Good"
+    return "Excellent"
+
+
+BOUNDARY_SCORES = [0, 49.99, 50, 50.01, 69.99, 70, 70.01, 84.99, 85, 85.01, 100, np.nan]
+
+
+def test_day_counts_matches_row_wise():
+    values = pd.Series([np.nan, '', '3', '3.0', '7.9', 4.7, 0, 12, None], dtype=object)
+    assert app.day_counts(values).tolist() == [old_day_count(x) for x in values]
+
+def test_day_counts_empty():
+    assert app.day_counts(pd.Series([], dtype=object)).tolist() == []
+
+def test_attendance_percentages_matches_row_wise():
+    days_present, total_days = np.meshgrid(np.arange(0, 201), np.arange(0, 201))
+    days_present, total_days = days_present.ravel(), total_days.ravel()
+    expected = [old_attendance_percentage(p, t) for p, t in zip(days_present, total_days)]
+    assert app.attendance_percentages(days_present, total_days).tolist() == expected
+
+def test_attendance_percentages_zero_total_days():
+    assert app.attendance_percentages([0, 5, 3], [0, 0, 4]).tolist() == [0.0, 0.0, 75.0]
+
+def test_attendance_percentages_empty():
+    assert app.attendance_percentages([], []).tolist() == []
+
+def test_derive_attendance_columns_fills_blank_cells():
+    df = pd.DataFrame({'days_present': [np.nan, 3, 2], 'total_days': [4, np.nan, 0]})
+    app._derive_attendance_columns(df)
+    assert df['days_present'].tolist() == [0, 3, 2]
+    assert df['total_days'].tolist() == [4, 0, 0]
+    assert df['attendance_percentage'].tolist() == [0.0, 0.0, 0.0]
+
+def test_derive_attendance_columns_empty_roster():
+    df = app._derive_attendance_columns(pd.DataFrame(columns=['student_id']))
+    assert len(df) == 0
+    assert {'days_present', 'total_days', 'attendance_percentage'} <= set(df.columns)
+
+def test_score_categories_boundaries():
+    assert app.score_categories(BOUNDARY_SCORES).tolist() == [old_score_category(s) for s in BOUNDARY_SCORES]
+
+def test_score_categories_empty():
+    assert app.score_categories([]).tolist() == []
+
+@pytest.mark.parametrize('attendance', [0, 49.99, 50, 50.01, 100, np.nan])
+def test_performance_categories_boundaries(attendance):
+    df = pd.DataFrame({'final_exam_score': BOUNDARY_SCORES, 'attendance_percentage': attendance})
+    expected = df.apply(old_performance_category, axis=1).tolist()
+    assert app.performance_categories(df['final_exam_score'], df['attendance_percentage']).tolist() == expected
+
+def test_performance_categories_matches_row_wise():
+    rng = np.random.default_rng(0)
+    n = 5000
+    df = pd.DataFrame({
+        'final_exam_score': rng.uniform(0, 100, n).round(1),
+        'attendance_percentage': rng.uniform(0, 100, n).round(0),
+    })
+    df.loc[rng.random(n) < 0.1, 'final_exam_score'] = np.nan
+    df.loc[rng.random(n) < 0.05, 'attendance_percentage'] = np.nan
+    expected = df.apply(old_performance_category, axis=1).tolist()
+    assert app.performance_categories(df['final_exam_score'], df['attendance_percentage']).tolist() == expected
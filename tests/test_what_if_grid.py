@@ -0,0 +1,65 @@
+"""
+/what_if_grid: the axes come back in the order the flat scores are laid out
+in, and bad ranges are rejected with a 400.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+
+import app
+
+
+@pytest.fixture
+def model(monkeypatch):
+    # A fitted model whose output depends on each input differently, so swapped axes show up
+    rng = np.random.default_rng(0)
+    feature_cols = list(app.PREDICTION_FEATURES)
+    X = pd.DataFrame(rng.uniform(0, 100, (50, len(feature_cols))), columns=feature_cols)
+    y = X @ np.array([0.1, 0.2, 0.3, 0.4])
+    fitted = LinearRegression().fit(X, y)
+    monkeypatch.setattr(app.prediction_models, 'get', lambda *args, **kwargs: (fitted, feature_cols, None))
+    return fitted, feature_cols
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+def test_scores_follow_axis_order(model, client):
+    fitted, feature_cols = model
+    response = client.post('/what_if_grid', json={
+        'attendance': [60, 90],
+        'test1': {'start': 10, 'stop': 30, 'step': 10},
+        'test2': 55,
+        'assignment': [20, 40, 80, 100],
+    })
+    assert response.status_code == 200
+    body = response.get_json()
+    names = [axis['name'] for axis in body['axes']]
+    assert names == list(app.WHAT_IF_INPUTS)
+    assert body['shape'] == [len(axis['values']) for axis in body['axes']] == [2, 3, 1, 4]
+
+    # Read one cell the way a client would: index each axis in the listed order
+    index = (1, 2, 0, 3)
+    inputs = {axis['name']: axis['values'][i] for axis, i in zip(body['axes'], index)}
+    assert inputs == {'attendance': 90, 'test1': 30, 'test2': 55, 'assignment': 100}
+    cell = body['predicted_scores'][int(np.ravel_multi_index(index, body['shape']))]
+    row = pd.DataFrame([{app.WHAT_IF_INPUTS[name]: value for name, value in inputs.items()}])[feature_cols]
+    assert cell == pytest.approx(float(np.clip(fitted.predict(row)[0], 0, 100)), abs=0.01)
+
+@pytest.mark.parametrize('spec', [
+    {'start': 0, 'stop': float('inf')},
+    {'start': 10, 'stop': 0},
+    {'start': 0, 'stop': 10, 'step': 0},
+    [],
+    'abc',
+])
+def test_bad_axis_is_rejected(model, client, spec):
+    data = {'attendance': 80, 'test1': spec, 'test2': 70, 'assignment': 70}
+    response = client.post('/what_if_grid', json=data)
+    assert response.status_code == 400
+
+def test_infinity_literal_is_rejected(model, client):
+    body = '{"attendance": {"start": 0, "stop": Infinity}, "test1": 70, "test2": 70, "assignment": 70}'
+    response = client.post('/what_if_grid', data=body, content_type='application/json')
+    assert response.status_code == 400